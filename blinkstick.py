@@ -32,7 +32,13 @@
 import time
 import sys
 import re
-import collections
+import array
+import os
+import struct
+import threading
+import functools
+import abc
+from concurrent.futures import ThreadPoolExecutor
 
 if sys.platform == "win32":
     import pywinusb.hid as hid
@@ -50,10 +56,283 @@ Main module to control BlinkStick and BlinkStick Pro devices.
 VENDOR_ID = 0x20a0
 PRODUCT_ID = 0x41e5
 
+# Padding for LED data reports and fill for the shadow frame flags
+_ZEROS = memoryview(bytes(64 * 3))
+_ONES = memoryview(b'\x01' * 64)
+
+# Device states reported by BlinkStick.get_state
+DEVICE_CONNECTED = "connected"
+DEVICE_RECONNECTING = "reconnecting"
+DEVICE_GONE = "gone"
+
 class BlinkStickException(Exception):
     pass
 
 
+class BlinkStickTransportError(BlinkStickException):
+    """
+    Raised by a transport when a transfer to the device fails.
+    """
+    pass
+
+
+class BlinkStickTransport(abc.ABC):
+    """
+    Base class for the way L{BlinkStick} talks to a device. A transport sends and receives
+    HID feature reports as USB control transfers and reads the device string descriptors.
+    Subclasses implement L{ctrl_transfer} and L{get_string}.
+
+    Transfer failures raise one of the exception types in L{errors}, after which
+    L{BlinkStick} tries to find the device again by serial number.
+    """
+
+    errors = (BlinkStickTransportError,)
+
+    def open(self):
+        """
+        Prepare the device for transfers.
+        """
+        return True
+
+    @abc.abstractmethod
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength):
+        """
+        Perform a control transfer.
+
+        @type  bmRequestType: int
+        @param bmRequestType: 0x20 to send a feature report, 0x80 | 0x20 to read one
+        @type  wValue: int
+        @param wValue: the report ID
+        @param data_or_wLength: data to send, or number of bytes to read
+        @return: the data read for 0x80 | 0x20 requests
+        """
+
+    @abc.abstractmethod
+    def get_string(self, index):
+        """
+        Read a string descriptor: 1 - manufacturer, 2 - description, 3 - serial number.
+        """
+
+
+class UsbTransport(BlinkStickTransport):
+    """
+    Transport using pyusb control transfers.
+    """
+
+    if sys.platform != "win32":
+        errors = (BlinkStickTransportError, usb.USBError)
+
+    def __init__(self, device):
+        self.device = device
+
+    def open(self):
+        if self.device.is_kernel_driver_active(0):
+            try:
+                self.device.detach_kernel_driver(0)
+            except usb.core.USBError as e:
+                raise BlinkStickException("Could not detach kernel driver: %s" % str(e))
+
+        return True
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength):
+        return self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength)
+
+    def get_string(self, index):
+        return usb.util.get_string(self.device, index)
+
+
+class HidTransport(BlinkStickTransport):
+    """
+    Transport using pywinusb feature reports on Windows.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.reports = None
+
+    def open(self):
+        self.device.open()
+        self.reports = self.device.find_feature_reports()
+        return True
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength):
+        if bmRequestType == 0x20:
+            data = (c_ubyte * len(data_or_wLength)).from_buffer_copy(bytes(data_or_wLength))
+            data[0] = wValue
+            if not self.device.send_feature_report(data):
+                raise BlinkStickTransportError("Could not send feature report {0}".format(wValue))
+
+        elif bmRequestType == 0x80 | 0x20:
+            return self.reports[wValue - 1].get()
+
+    def get_string(self, index):
+        if index == 1:
+            return self.device.vendor_name
+        elif index == 2:
+            return self.device.product_name
+        else:
+            return self.device.serial_number
+
+
+class MockTransport(BlinkStickTransport):
+    """
+    In-memory BlinkStick for running code and benchmarks without hardware attached.
+
+    It implements the feature reports used by L{BlinkStick}: 1 (color), 2 and 3 (info
+    blocks), 4 (mode), 5 (single LED color), 6-9 (LED data frames) and 0x81 (LED count),
+    and keeps the resulting device state. Every transfer waits for L{latency} seconds
+    and is counted in L{transfers}.
+
+    Use L{add_mock_device} to make L{find_all}, L{find_first} and L{find_by_serial}
+    return mock devices.
+    """
+
+    def __init__(self, serial="BS000001-3.0", latency=0.0, manufacturer="Agile Innovative Ltd", description="BlinkStick"):
+        """
+        @type  serial: str
+        @param serial: serial number reported by the device
+        @type  latency: float
+        @param latency: seconds each transfer takes
+        """
+        self.serial = serial
+        self.manufacturer = manufacturer
+        self.description = description
+        self.latency = latency
+        self.connected = True
+        self.transfers = 0
+
+        self.info_blocks = {2: bytearray(32), 3: bytearray(32)}
+        self.mode = 0
+        self.led_count = 1
+        # GRB data for up to 64 LEDs on each of the R, G and B channels
+        self.led_data = [bytearray(64 * 3), bytearray(64 * 3), bytearray(64 * 3)]
+
+    @property
+    def color(self):
+        """
+        The [r, g, b] color of LED 0 on the R channel, which report 1 sets and reads.
+        Reports 5-9 change it too.
+        """
+        g, r, b = self.led_data[0][0:3]
+        return [r, g, b]
+
+    @color.setter
+    def color(self, value):
+        r, g, b = value
+        self.led_data[0][0:3] = bytearray([g, r, b])
+
+    def unplug(self):
+        """
+        Make the device fail every transfer and disappear from the find functions.
+        """
+        self.connected = False
+
+    def plug(self):
+        """
+        Undo L{unplug}.
+        """
+        self.connected = True
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength):
+        if self.latency:
+            time.sleep(self.latency)
+
+        if not self.connected:
+            raise BlinkStickTransportError("Mock BlinkStick {0} is unplugged".format(self.serial))
+
+        self.transfers += 1
+
+        if bmRequestType == 0x20:
+            self._set_report(wValue, bytearray(data_or_wLength))
+        elif bmRequestType == 0x80 | 0x20:
+            report = self._get_report(wValue)
+            report.extend(bytearray(max(data_or_wLength - len(report), 0)))
+            return array.array('B', report[:data_or_wLength])
+
+    def _set_report(self, report_id, data):
+        if report_id == 1:
+            self.led_data[0][0:3] = bytearray([data[2], data[1], data[3]])
+        elif report_id in (2, 3):
+            self.info_blocks[report_id][:] = data[1:33].ljust(32, b'\0')
+        elif report_id == 4:
+            self.mode = data[1]
+        elif report_id == 5:
+            channel, index = data[1], data[2]
+            self.led_data[channel][index * 3:index * 3 + 3] = bytearray([data[4], data[3], data[5]])
+        elif 6 <= report_id <= 9:
+            channel = data[1]
+            frame = data[2:2 + 64 * 3]
+            self.led_data[channel][:len(frame)] = frame
+        elif report_id == 0x81:
+            self.led_count = data[1]
+        else:
+            raise BlinkStickTransportError("Mock BlinkStick does not support report {0}".format(report_id))
+
+    def _get_report(self, report_id):
+        if report_id == 1:
+            return bytearray([1] + self.color)
+        elif report_id in (2, 3):
+            return bytearray([report_id]) + self.info_blocks[report_id]
+        elif report_id == 4:
+            return bytearray([4, self.mode])
+        elif 6 <= report_id <= 9:
+            # Frames are read back for the R channel, which is what the device does too
+            return bytearray([report_id, 0]) + self.led_data[0]
+        elif report_id == 0x81:
+            return bytearray([0x81, self.led_count])
+        else:
+            raise BlinkStickTransportError("Mock BlinkStick does not support report {0}".format(report_id))
+
+    def get_string(self, index):
+        if not self.connected:
+            raise BlinkStickTransportError("Mock BlinkStick {0} is unplugged".format(self.serial))
+
+        if index == 1:
+            return self.manufacturer
+        elif index == 2:
+            return self.description
+        else:
+            return self.serial
+
+
+class DeviceHealth(object):
+    """
+    Tracks whether a L{BlinkStick} is reachable and when to next try reconnecting to it.
+
+    After a failed reconnect, transfers fail straight away until the backoff (doubling
+    from L{initial_backoff} up to L{max_backoff} seconds) runs out, or until the
+    L{DeviceRegistry} sees the device plugged in again, e.g. from the
+    L{start_hotplug_monitor} thread. That way a missing device costs its callers
+    nothing instead of a bus scan on every frame.
+    """
+
+    initial_backoff = 0.1
+    max_backoff = 5.0
+
+    def __init__(self):
+        self.state = DEVICE_CONNECTED
+        self.failures = 0
+        self.next_retry = 0.0
+        self.appearances = 0
+
+    def retry_due(self, serial):
+        """
+        Whether it is time to try reconnecting to the device with serial.
+        """
+        return time.monotonic() >= self.next_retry or _registry.appearances(serial) > self.appearances
+
+    def failed(self):
+        self.failures += 1
+        self.state = DEVICE_RECONNECTING
+        self.next_retry = time.monotonic() + min(self.initial_backoff * 2 ** (self.failures - 1), self.max_backoff)
+
+    def connected(self, serial):
+        if self.state != DEVICE_CONNECTED:
+            self.state = DEVICE_CONNECTED
+            self.failures = 0
+        self.appearances = _registry.appearances(serial)
+
+
 class BlinkStick(object):
     """
     BlinkStick class is designed to control regular BlinkStick devices, or BlinkStick Pro
@@ -213,72 +492,122 @@ class BlinkStick(object):
                      'yellow': '#ffff00',
                      'yellowgreen': '#9acd32'}
 
+    # The same colors as RGB tuples, so looking up a name does not parse its hex value
+    _names_to_rgb = dict((name, (int(value[1:3], 16), int(value[3:5], 16), int(value[5:7], 16)))
+                         for name, value in _names_to_hex.items())
+
     HEX_COLOR_RE = re.compile(r'^#([a-fA-F0-9]{3}|[a-fA-F0-9]{6})$')
 
     inverse = False
     error_reporting = True
     max_rgb_value = 255
+    gamma = 1.0
+    brightness = 1.0
+    write_cache = False
 
-    def __init__(self, device=None, error_reporting=True):
+    def __init__(self, device=None, error_reporting=True, write_cache=False):
         """
         Constructor for the class.
 
         @type  error_reporting: Boolean
         @param error_reporting: display errors if they occur during communication with the device
+        @type  write_cache: Boolean
+        @param write_cache: skip sending a color that is already set, see L{set_write_cache}
         """
         self.error_reporting = error_reporting
+        self.write_cache = write_cache
+        self.health = DeviceHealth()
+        self.bs_serial = None
+        # (channel, index) -> (r, g, b) last sent with set_color
+        self._written_colors = {}
+        # GRB frame last sent to each channel, how many LEDs of it are in use and
+        # whether a whole frame has been sent, see set_colors
+        self._frames = [bytearray(64 * 3), bytearray(64 * 3), bytearray(64 * 3)]
+        self._frame_lengths = [0, 0, 0]
+        self._frame_sent = [False, False, False]
+        # Which LEDs of each shadow frame are known to match the device, see get_color
+        self._frame_known = [bytearray(64), bytearray(64), bytearray(64)]
+        self._send_time = 0.0
+        # Lookup table for the color settings it was built for, see _color_table
+        self._table_key = None
+        self._table = None
+        # Report buffers are allocated once per report ID and filled in place
+        self._reports = {1: bytearray(4), 4: bytearray(2), 5: bytearray(6), 0x81: bytearray(2)}
+        for report_id, max_leds in ((6, 8), (7, 16), (8, 32), (9, 64)):
+            self._reports[report_id] = bytearray(2 + max_leds * 3)
+        self._report_views = dict((report_id, memoryview(report)) for report_id, report in self._reports.items())
 
         if device:
             self.device = device
-            if sys.platform == "win32":
-                self.device.open()
-                self.reports = self.device.find_feature_reports()
-            else:
-                self.open_device(device)
+            self.transport = _transport_for(device)
+            self.open_device(device)
+
+            self.bs_serial = _registry.serial_of(device) or self.get_serial()
+            self.health.connected(self.bs_serial)
+
+    def _usb_get_string(self, index):
+        return self._transfer('get_string', index)
 
-            self.bs_serial = self.get_serial()
+    def _usb_ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength):
+        return self._transfer('ctrl_transfer', bmRequestType, bRequest, wValue, wIndex, data_or_wLength)
+
+    def _transfer(self, name, *args):
+        # Call the transport method by name, as the transport changes on reconnect
+        if self.health.state != DEVICE_CONNECTED:
+            if not self.health.retry_due(self.bs_serial):
+                raise BlinkStickException("BlinkStick {0} is {1} - skipping transfer".format(self.bs_serial, self.get_state()))
+
+            if not self._refresh_device():
+                self.health.failed()
+                raise BlinkStickException("Could not communicate with BlinkStick {0} - it may have been removed".format(self.bs_serial))
 
-    def _usb_get_string(self, device, index):
         try:
-            return usb.util.get_string(device, index)
-        except usb.USBError:
+            result = getattr(self.transport, name)(*args)
+        except self.transport.errors:
             # Could not communicate with BlinkStick device
-            # attempt to find it again based on serial
+            # attempt to find it again based on serial, unless that was just done
 
-            if self._refresh_device():
-                return usb.util.get_string(self.device, index)
-            else:
+            if self.health.state != DEVICE_CONNECTED or not self._refresh_device():
+                self.health.failed()
                 raise BlinkStickException("Could not communicate with BlinkStick {0} - it may have been removed".format(self.bs_serial))
 
-    def _usb_ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, data_or_wLength):
-        if sys.platform == "win32":
-            if bmRequestType == 0x20:
-                data = (c_ubyte * len(data_or_wLength))(*[c_ubyte(ord(c)) for c in data_or_wLength])
-                data[0] = wValue
-                if not self.device.send_feature_report(data):
-                    if self._refresh_device():
-                        self.device.send_feature_report(data)
-                    else:
-                        raise BlinkStickException("Could not communicate with BlinkStick {0} - it may have been removed".format(self.bs_serial))
-
-            elif bmRequestType == 0x80 | 0x20:
-                return self.reports[wValue - 1].get()
-        else:
             try:
-                return self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength)
-            except usb.USBError:
-                # Could not communicate with BlinkStick device
-                # attempt to find it again based on serial
+                result = getattr(self.transport, name)(*args)
+            except self.transport.errors:
+                self.health.failed()
+                raise BlinkStickException("Could not communicate with BlinkStick {0} - it may have been removed".format(self.bs_serial))
 
-                if self._refresh_device():
-                    return self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, data_or_wLength)
-                else:
-                    raise BlinkStickException("Could not communicate with BlinkStick {0} - it may have been removed".format(self.bs_serial))
+        self.health.connected(self.bs_serial)
+        return result
+
+    def get_state(self):
+        """
+        Get the connection state of the device:
+
+            - L{DEVICE_CONNECTED} - the last transfer worked
+            - L{DEVICE_RECONNECTING} - transfers are failing but the device is still on the bus
+            - L{DEVICE_GONE} - the device was not found the last time the bus was scanned
+
+        @rtype: str
+        @return: one of DEVICE_CONNECTED, DEVICE_RECONNECTING or DEVICE_GONE
+        """
+        if self.health.state == DEVICE_CONNECTED:
+            return DEVICE_CONNECTED
+        elif _registry.get(self.bs_serial) is None:
+            return DEVICE_GONE
+        else:
+            return DEVICE_RECONNECTING
 
     def _refresh_device(self):
-        d = find_by_serial(self.bs_serial)
+        # Whatever happened, the device may not be showing what we last sent any more
+        self._written_colors.clear()
+        self._forget_frames()
+
+        d = _registry.find(self.bs_serial)
         if d:
-            self.device = d.device
+            self.device = d
+            self.transport = _transport_for(d)
+            self.transport.open()
             return True
 
     def get_serial(self):
@@ -296,10 +625,7 @@ class BlinkStick(object):
         @rtype: str
         @return: Serial number of the device
         """
-        if sys.platform == "win32":
-            return self.device.serial_number
-        else:
-            return self._usb_get_string(self.device, 3)
+        return self._usb_get_string(3)
 
     def get_manufacturer(self):
         """
@@ -308,10 +634,7 @@ class BlinkStick(object):
         @rtype: str
         @return: Device manufacturer's name
         """
-        if sys.platform == "win32":
-            return self.device.vendor_name
-        else:
-            return self._usb_get_string(self.device, 1)
+        return self._usb_get_string(1)
 
 
     def get_description(self):
@@ -321,10 +644,7 @@ class BlinkStick(object):
         @rtype: str
         @return: Device description
         """
-        if sys.platform == "win32":
-            return self.device.product_name
-        else:
-            return self._usb_get_string(self.device, 2)
+        return self._usb_get_string(2)
 
     def set_error_reporting(self, error_reporting):
         """
@@ -351,29 +671,112 @@ class BlinkStick(object):
         @param hex: Specify color using hexadecimal color value e.g. '#FF3366'
         """
 
+        r, g, b = self._color_bytes(red=red, green=green, blue=blue, name=name, hex=hex)
+
+        self._send_color(channel, index, r, g, b)
+
+    def _color_bytes(self, red=0, green=0, blue=0, name=None, hex=None):
+        # The r, g, b bytes set_color sends for a color
         red, green, blue = self._determine_rgb(red=red, green=green, blue=blue, name=name, hex=hex)
 
-        r = int(round(red, 3))
-        g = int(round(green, 3))
-        b = int(round(blue, 3))
+        return _lookup_rgb(self._get_table(), red, green, blue)
+
+    def _get_table(self):
+        # The table is shared between devices with the same settings and only looked
+        # up again when a setting changes
+        key = (self.max_rgb_value, self.inverse, self.gamma, self.brightness)
+        if key != self._table_key:
+            self._table = _color_table(*key)
+            self._table_key = key
+        return self._table
+
+    def _check_led(self, channel, index=0):
+        # The device and the shadow frames have 3 channels of 64 LEDs
+        if channel not in (0, 1, 2):
+            raise BlinkStickException("Channel {0} should be 0, 1 or 2".format(channel))
+        if not 0 <= index < 64:
+            raise BlinkStickException("LED index {0} should be in the range 0..63".format(index))
 
-        if self.inverse:
-            r, g, b = 255 - r, 255 - g, 255 - b
+    def _send_color(self, channel, index, r, g, b):
+        self._check_led(channel, index)
+
+        if self.write_cache and self._written_colors.get((channel, index)) == (r, g, b):
+            return
 
         if index == 0 and channel == 0:
-            control_string = bytes(bytearray([0, r, g, b]))
             report_id = 0x0001
+            control_string = self._report_views[report_id]
+            struct.pack_into('4B', control_string, 0, 0, r, g, b)
         else:
-            control_string = bytes(bytearray([5, channel, index, r, g, b]))
             report_id = 0x0005
+            control_string = self._report_views[report_id]
+            struct.pack_into('6B', control_string, 0, 5, channel, index, r, g, b)
 
-        if self.error_reporting:
+        try:
             self._usb_ctrl_transfer(0x20, 0x9, report_id, 0, control_string)
+        except Exception:
+            self._written_colors.clear()
+            self._frame_known[channel][index] = 0
+            if self.error_reporting:
+                raise
+            return
+
+        if self.write_cache:
+            self._written_colors[(channel, index)] = (r, g, b)
+
+        self._frames[channel][index * 3:index * 3 + 3] = bytearray([g, r, b])
+        self._frame_lengths[channel] = max(self._frame_lengths[channel], index + 1)
+        self._frame_known[channel][index] = 1
+
+    def set_colors(self, channel, colors):
+        """
+        Set the color of several LEDs on a channel of BlinkStick Pro/Flex at once.
+
+        The colors are merged into the frame this object last sent to the channel and
+        sent with a single LED data report, or with a single color report when only one
+        LED changes. LEDs this object has never set are sent as off.
+
+            >>> b.set_colors(0, {0: (255, 0, 0), 5: (0, 0, 255)})
+            >>> b.set_colors(1, [(255, 0, 0), (0, 255, 0), None, (0, 0, 255)])
+
+        @type  channel: int
+        @param channel: the channel of the LEDs (R=0, G=1, B=2)
+        @type  colors: dict or list
+        @param colors: index -> (r, g, b), or a list of (r, g, b) from index 0 where None leaves the LED as it is
+        """
+        if isinstance(colors, dict):
+            items = colors.items()
         else:
-            try:
-                self._usb_ctrl_transfer(0x20, 0x9, report_id, 0, control_string)
-            except Exception:
-                pass
+            items = [(index, color) for index, color in enumerate(colors) if color is not None]
+
+        self._check_led(channel)
+        frame = self._frames[channel]
+        changes = []
+        for index, color in items:
+            self._check_led(channel, index)
+            r, g, b = self._color_bytes(red=color[0], green=color[1], blue=color[2])
+            # Until a whole frame has been sent the device may not match the shadow frame
+            if not self._frame_sent[channel] or frame[index * 3:index * 3 + 3] != bytearray([g, r, b]):
+                changes.append((index, r, g, b))
+
+        if len(changes) == 1:
+            # One color report is smaller than a whole frame
+            self._send_color(channel, *changes[0])
+        elif changes:
+            data = bytearray(frame)
+            for index, r, g, b in changes:
+                data[index * 3:index * 3 + 3] = bytearray([g, r, b])
+            length = max(self._frame_lengths[channel], max(change[0] for change in changes) + 1)
+            self.set_led_data(channel, data[:length * 3])
+
+    def parse_color(self, red=0, green=0, blue=0, name=None, hex=None):
+        """
+        Get the r, g, b values L{set_color} would use for these arguments.
+
+        @rtype: (int, int, int)
+        @return: r, g, b color
+        """
+        return self._determine_rgb(red=red, green=green, blue=blue, name=name, hex=hex)
 
     def _determine_rgb(self, red=0, green=0, blue=0, name=None, hex=None):
 
@@ -391,32 +794,50 @@ class BlinkStick(object):
         except ValueError:
             red = green = blue = 0
 
-        red, green, blue = _remap_rgb_value([red, green, blue], self.max_rgb_value)
-
         # TODO - do smarts to determine input type from red var in case it is not int
 
         return red, green, blue
 
-    def _get_color_rgb(self, index=0):
+    def _get_color_rgb(self, index=0, refresh=False):
+        r, g, b = self._read_color(0, index, refresh)
+        if index == 0 and self.inverse:
+            return [255 - r, 255 - g, 255 - b]
+        else:
+            return [r, g, b]
+
+    def _read_color(self, channel=0, index=0, refresh=False):
+        # The r, g, b bytes the device shows, from the shadow frame when it is known
+        frame = self._frames[channel]
+        if not refresh and self._frame_known[channel][index]:
+            return [frame[index * 3 + 1], frame[index * 3], frame[index * 3 + 2]]
+
         if index == 0:
             device_bytes = self._usb_ctrl_transfer(0x80 | 0x20, 0x1, 0x0001, 0, 33)
-            if self.inverse:
-                return [255 - device_bytes[1], 255 - device_bytes[2], 255 - device_bytes[3]]
-            else:
-                return [device_bytes[1], device_bytes[2], device_bytes[3]]
+
+            r, g, b = device_bytes[1], device_bytes[2], device_bytes[3]
         else:
             data = self.get_led_data((index + 1) * 3)
 
-            return [data[index * 3 + 1], data[index * 3], data[index * 3 + 2]]
+            r, g, b = data[index * 3 + 1], data[index * 3], data[index * 3 + 2]
+
+        if channel == 0:
+            frame[index * 3:index * 3 + 3] = bytearray([g, r, b])
+            self._frame_known[channel][index] = 1
+
+        return [r, g, b]
 
-    def _get_color_hex(self, index=0):
-        r, g, b = self._get_color_rgb(index)
+    def _get_color_hex(self, index=0, refresh=False):
+        r, g, b = self._get_color_rgb(index, refresh)
         return '#%02x%02x%02x' % (r, g, b)
 
-    def get_color(self, index=0, color_format='rgb'):
+    def get_color(self, index=0, color_format='rgb', refresh=False):
         """
         Get the current device color in the defined format.
 
+        The color is remembered from the last time this object set or read it, so
+        only the first call for each LED reads the device. Pass refresh=True to read
+        the device again, e.g. when another program may have changed it.
+
         Currently supported formats:
 
             1. rgb (default) - Returns values as 3-tuple (r,g,b)
@@ -433,6 +854,8 @@ class BlinkStick(object):
         @param index: the index of the LED
         @type  color_format: str
         @param color_format: "rgb" or "hex". Defaults to "rgb".
+        @type  refresh: bool
+        @param refresh: read the color from the device instead of memory
 
         @rtype: (int, int, int) or str
         @return: Either 3-tuple for R, G and B values, or hex string
@@ -440,8 +863,8 @@ class BlinkStick(object):
 
         # Attempt to find a function to return the appropriate format
         get_color_func = getattr(self, "_get_color_%s" % color_format, self._get_color_rgb)
-        if isinstance(get_color_func, collections.Callable):
-            return get_color_func(index)
+        if callable(get_color_func):
+            return get_color_func(index, refresh)
         else:
             # Should never get here, as we should always default to self._get_color_rgb
             raise BlinkStickException("Could not return current color in format %s" % color_format)
@@ -474,18 +897,42 @@ class BlinkStick(object):
         @type  data: int[0..64*3]
         @param data: The LED data frame in GRB format
         """
+        self._check_led(channel)
 
         report_id, max_leds = self._determine_report_id(len(data))
 
-        report = [0, channel]
+        report = self._reports[report_id]
+        size = max_leds * 3
+        count = min(len(data), size)
 
-        for i in range(0, max_leds * 3):
-            if len(data) > i:
-                report.append(data[i])
-            else:
-                report.append(0)
+        report[1] = channel
+        if count == len(data):
+            report[2:2 + count] = data
+        else:
+            report[2:2 + count] = data[:count]
+        # Pad with zeros, without allocating them every frame
+        report[2 + count:] = _ZEROS[:size - count]
+
+        # The frame overwrites every LED on the channel
+        for key in [key for key in self._written_colors if key[0] == channel]:
+            del self._written_colors[key]
 
-        self._usb_ctrl_transfer(0x20, 0x9, report_id, 0, bytes(bytearray(report)))
+        try:
+            self._usb_ctrl_transfer(0x20, 0x9, report_id, 0, self._report_views[report_id])
+        except Exception:
+            self._frame_known[channel][:] = _ZEROS[:64]
+            raise
+
+        self._frames[channel][:size] = self._report_views[report_id][2:]
+        self._frame_lengths[channel] = max(self._frame_lengths[channel], (len(data) + 2) // 3)
+        self._frame_sent[channel] = True
+        self._frame_known[channel][:max_leds] = _ONES[:max_leds]
+
+    def _forget_frames(self):
+        # Read the device again before trusting the shadow frames
+        for channel in range(3):
+            self._frame_known[channel][:] = _ZEROS[:64]
+            self._frame_sent[channel] = False
 
     def get_led_data(self, count):
         """
@@ -518,8 +965,10 @@ class BlinkStick(object):
         @type  mode: int
         @param mode: Device mode to set
         """
-        control_string = bytes(bytearray([4, mode]))
+        control_string = self._report_views[4]
+        struct.pack_into('2B', control_string, 0, 4, mode)
 
+        self._written_colors.clear()
         self._usb_ctrl_transfer(0x20, 0x9, 0x0004, 0, control_string)
 
     def get_mode(self):
@@ -552,7 +1001,8 @@ class BlinkStick(object):
         @type  count: int
         @param count: number of LEDs to control
         """
-        control_string = bytes(bytearray([0x81, count]))
+        control_string = self._report_views[0x81]
+        struct.pack_into('2B', control_string, 0, 0x81, count)
 
         self._usb_ctrl_transfer(0x20, 0x9, 0x81, 0, control_string)
 
@@ -679,16 +1129,17 @@ class BlinkStick(object):
         @type  repeats: int
         @param repeats: Number of times to pulse the LED
         @type  duration: int
-        @param duration: Duration for pulse in milliseconds
+        @param duration: Duration for each half of the pulse in milliseconds
         @type  steps: int
         @param steps: Number of gradient steps
         """
         r, g, b = self._determine_rgb(red=red, green=green, blue=blue, name=name, hex=hex)
 
+        deadline = time.monotonic()
         self.turn_off()
         for x in range(repeats):
-            self.morph(channel=channel, index=index, red=r, green=g, blue=b, duration=duration, steps=steps)
-            self.morph(channel=channel, index=index, red=0, green=0, blue=0, duration=duration, steps=steps)
+            deadline = self._fade(channel, index, (0, 0, 0), (r, g, b), duration, steps, deadline)
+            deadline = self._fade(channel, index, (r, g, b), (0, 0, 0), duration, steps, deadline)
 
     def blink(self, channel=0, index=0, red=0, green=0, blue=0, name=None, hex=None, repeats=1, delay=500):
         """
@@ -711,11 +1162,11 @@ class BlinkStick(object):
         """
         r, g, b = self._determine_rgb(red=red, green=green, blue=blue, name=name, hex=hex)
         ms_delay = float(delay) / float(1000)
+        started = time.monotonic()
         for x in range(repeats):
-            if x:
-                time.sleep(ms_delay)
+            _sleep_until(started + 2 * x * ms_delay)
             self.set_color(channel=channel, index=index, red=r, green=g, blue=b)
-            time.sleep(ms_delay)
+            _sleep_until(started + (2 * x + 1) * ms_delay)
             self.set_color(channel=channel, index=index)
 
     def morph(self, channel=0, index=0, red=0, green=0, blue=0, name=None, hex=None, duration=1000, steps=50):
@@ -735,40 +1186,65 @@ class BlinkStick(object):
         @type  duration: int
         @param duration: Duration for morph in milliseconds
         @type  steps: int
-        @param steps: Number of gradient steps (default 50)
+        @param steps: Number of gradient steps (default 50). Fewer are used if the device
+            cannot take that many transfers within duration.
         """
 
-        r_end, g_end, b_end = self._determine_rgb(red=red, green=green, blue=blue, name=name, hex=hex)
+        started = time.monotonic()
+
+        end = self._determine_rgb(red=red, green=green, blue=blue, name=name, hex=hex)
+
+        start = self.get_morph_start(channel, index)
+
+        self._fade(channel, index, start, end, duration, steps, started)
 
-        r_start, g_start, b_start = _remap_rgb_value_reverse(self._get_color_rgb(index), self.max_rgb_value)
+    def _fade(self, channel, index, start, end, duration, steps, started):
+        # Fade from start to end on the deadlines planned by Fade. Returns the end deadline.
+        fade = self.plan_fade(start, end, duration, steps, started)
 
-        if r_start > 255 or g_start > 255 or b_start > 255:
-            r_start = 0
-            g_start = 0
-            b_start = 0
+        for deadline in fade:
+            _sleep_until(deadline)
+            color = fade.color_due(time.monotonic())
+            if color is not None:
+                self.set_color(channel=channel, index=index, red=color[0], green=color[1], blue=color[2])
+                fade.sent(time.monotonic())
 
-        gradient = []
+        _sleep_until(fade.last_deadline())
+        self.set_color(channel=channel, index=index, red=end[0], green=end[1], blue=end[2])
 
-        steps += 1
-        for n in range(1, steps):
-            d = 1.0 * n / steps
-            r = (r_start * (1 - d)) + (r_end * d)
-            g = (g_start * (1 - d)) + (g_end * d)
-            b = (b_start * (1 - d)) + (b_end * d)
+        return fade.finished
 
-            gradient.append((r, g, b))
+    def plan_fade(self, start, end, duration, steps, started):
+        """
+        Plan a fade on this device, for callers that do their own waiting such as
+        blinkstick_async. See L{Fade}.
 
-        ms_delay = float(duration) / float(1000 * steps)
+        @type  start: (int, int, int)
+        @param start: r, g, b color the fade starts from
+        @type  end: (int, int, int)
+        @param end: r, g, b color the fade ends on
+        @type  duration: int
+        @param duration: Duration of the fade in milliseconds
+        @type  steps: int
+        @param steps: Number of gradient steps
+        @type  started: float
+        @param started: time.monotonic() the fade is measured from
 
-        self.set_color(channel=channel, index=index, red=r_start, green=g_start, blue=b_start)
+        @rtype: Fade
+        """
+        return Fade(self, start, end, duration, steps, started)
 
-        for grad in gradient:
-            grad_r, grad_g, grad_b = grad
+    def get_morph_start(self, channel=0, index=0):
+        """
+        Get the color a morph starts from: the one that makes the device show what it
+        shows now, taking inverse, gamma and brightness into account.
 
-            self.set_color(channel=channel, index=index, red=grad_r, green=grad_g, blue=grad_b)
-            time.sleep(ms_delay)
+        @rtype: (int, int, int)
+        @return: r, g, b color
+        """
+        reverse_table = _reverse_color_table(self.max_rgb_value, self.inverse, self.gamma, self.brightness)
 
-        self.set_color(channel=channel, index=index, red=r_end, green=g_end, blue=b_end)
+        return tuple(reverse_table[value] for value in self._read_color(channel, index))
 
     def open_device(self, d):
         """Open device.
@@ -777,13 +1253,7 @@ class BlinkStick(object):
         if self.device is None:
             raise BlinkStickException("Could not find BlinkStick...")
 
-        if self.device.is_kernel_driver_active(0):
-            try:
-                self.device.detach_kernel_driver(0)
-            except usb.core.USBError as e:
-                raise BlinkStickException("Could not detach kernel driver: %s" % str(e))
-
-        return True
+        return self.transport.open()
 
     def get_inverse(self):
         """
@@ -804,6 +1274,31 @@ class BlinkStick(object):
         @param value: True/False to set the inverse mode
         """
         self.inverse = value
+        self._written_colors.clear()
+
+    def get_write_cache(self):
+        """
+        Get whether L{set_color} skips colors that are already set.
+
+        @rtype: bool
+        @return: True if the write cache is enabled, otherwise false
+        """
+        return self.write_cache
+
+    def set_write_cache(self, value):
+        """
+        Enable or disable the write cache. When enabled L{set_color} remembers the last
+        color sent to each channel and index and does not send the same color again,
+        which saves USB transfers when the color is updated more often than it changes.
+
+        The cache is forgotten after communication errors, reconnects, L{set_mode}
+        and L{set_inverse}. Only enable it when nothing else changes the device.
+
+        @type  value: bool
+        @param value: True/False to enable the write cache
+        """
+        self.write_cache = value
+        self._written_colors.clear()
 
     def set_max_rgb_value(self, value):
         """
@@ -825,6 +1320,43 @@ class BlinkStick(object):
         """
         return self.max_rgb_value
 
+    def set_gamma(self, value):
+        """
+        Set gamma correction. {set_color} raises each R, G and B value scaled to 0..1
+        to this power, so values above 1.0 make dim colors look less washed out.
+
+        @type  value: float
+        @param value: gamma exponent, 1.0 (default) for no correction
+        """
+        self.gamma = value
+
+    def get_gamma(self):
+        """
+        Get gamma correction.
+
+        @rtype: float
+        @return: gamma exponent applied by {set_color}
+        """
+        return self.gamma
+
+    def set_brightness(self, value):
+        """
+        Set global brightness. {set_color} scales every color by this value.
+
+        @type  value: float
+        @param value: 0.0..1.0 brightness, 1.0 (default) for full brightness
+        """
+        self.brightness = value
+
+    def get_brightness(self):
+        """
+        Get global brightness.
+
+        @rtype: float
+        @return: 0.0..1.0 brightness applied by {set_color}
+        """
+        return self.brightness
+
     def _name_to_hex(self, name):
         """
         Convert a color name to a normalized hexadecimal color value.
@@ -864,8 +1396,7 @@ class BlinkStick(object):
         (0, 0, 128)
 
         """
-        hex_digits = self._normalize_hex(hex_value)
-        return tuple([int(s, 16) for s in (hex_digits[1:3], hex_digits[3:5], hex_digits[5:7])])
+        return _hex_to_rgb(hex_value)
 
     def _normalize_hex(self, hex_value):
         """
@@ -927,7 +1458,10 @@ class BlinkStick(object):
         (218, 165, 32)
 
         """
-        return self._hex_to_rgb(self._name_to_hex(name))
+        try:
+            return self._names_to_rgb[name.lower()]
+        except KeyError:
+            raise ValueError("'%s' is not defined as a named color." % (name))
 
 class BlinkStickPro(object):
     """
@@ -942,6 +1476,9 @@ class BlinkStickPro(object):
     U{https://github.com/arvydas/blinkstick-python/wiki#code-examples-for-blinkstick-pro}
     """
 
+    brightness = 1.0
+    gamma = 1.0
+
     def __init__(self, r_led_count=0, g_led_count=0, b_led_count=0, delay=0.002, max_rgb_value=255):
         """
         Initialize BlinkStickPro class.
@@ -968,21 +1505,21 @@ class BlinkStickPro(object):
 
         self.max_rgb_value = max_rgb_value
 
-        # initialise data store for each channel
+        # initialise data store for each channel as GRB bytes
         # pre-populated with zeroes
 
-        self.data = [[], [], []]
+        self.data = [bytearray(r_led_count * 3), bytearray(g_led_count * 3), bytearray(b_led_count * 3)]
 
-        for i in range(0, r_led_count):
-            self.data[0].append([0, 0, 0])
-
-        for i in range(0, g_led_count):
-            self.data[1].append([0, 0, 0])
+        self.bstick = None
 
-        for i in range(0, b_led_count):
-            self.data[2].append([0, 0, 0])
+        # Copy of the frame last sent to each channel and the brightness and gamma
+        # it was sent with, so send_data_all can skip what has not changed
+        self._sent = [None, None, None]
+        self._sent_settings = None
 
-        self.bstick = None
+        self._transmitter = None
+        # send_data may be called while the transmitter thread is sending
+        self._send_lock = threading.Lock()
 
     def set_color(self, channel, index, r, g, b, remap_values=True):
         """
@@ -1001,9 +1538,14 @@ class BlinkStickPro(object):
         """
 
         if remap_values:
-            r, g, b = [_remap_color(val, self.max_rgb_value) for val in [r, g, b]]
+            table = _color_table(self.max_rgb_value)
+            r, g, b = _lookup_rgb(table, r, g, b)
 
-        self.data[channel][index] = [g, r, b]
+        data = self.data[channel]
+        offset = index * 3
+        data[offset] = g
+        data[offset + 1] = r
+        data[offset + 2] = b
 
     def get_color(self, channel, index):
         """
@@ -1018,21 +1560,16 @@ class BlinkStickPro(object):
         @return: 3-tuple for R, G and B values
         """
 
-        val = self.data[channel][index]
-        return [val[1], val[0], val[2]]
+        data = self.data[channel]
+        offset = index * 3
+        return [data[offset + 1], data[offset], data[offset + 2]]
 
     def clear(self):
         """
         Set all pixels to black in the frame buffer.
         """
-        for x in range(0, self.r_led_count):
-            self.set_color(0, x, 0, 0, 0)
-
-        for x in range(0, self.g_led_count):
-            self.set_color(1, x, 0, 0, 0)
-
-        for x in range(0, self.b_led_count):
-            self.set_color(2, x, 0, 0, 0)
+        for data in self.data:
+            _clear(data)
 
     def off(self):
         """
@@ -1054,8 +1591,29 @@ class BlinkStickPro(object):
         else:
             self.bstick = find_by_serial(serial=serial)
 
+        self._sent = [None, None, None]
+
         return self.bstick is not None
 
+    def set_brightness(self, value):
+        """
+        Set global brightness applied to every frame when it is sent. The colors in
+        the internal buffer are not changed.
+
+        @type  value: float
+        @param value: 0.0..1.0 brightness, 1.0 (default) for full brightness
+        """
+        self.brightness = value
+
+    def set_gamma(self, value):
+        """
+        Set gamma correction applied to every frame when it is sent.
+
+        @type  value: float
+        @param value: gamma exponent, 1.0 (default) for no correction
+        """
+        self.gamma = value
+
     def send_data(self, channel):
         """
         Send data stored in the internal buffer to the channel.
@@ -1065,26 +1623,108 @@ class BlinkStickPro(object):
             - 1 - G pin on BlinkStick Pro board
             - 2 - B pin on BlinkStick Pro board
         """
-        packet_data = [item for sublist in self.data[channel] for item in sublist]
-
-        try:
-            self.bstick.set_led_data(channel, packet_data)
-            time.sleep(self.data_transmission_delay)
-        except Exception as e:
-            print("Exception: {0}".format(e))
+        self._send_data(channel, False)
 
     def send_data_all(self):
         """
-        Send data to all channels
+        Send data to all channels that changed since they were last sent.
+
+        Channels whose LEDs are the same as last time are skipped, and when only the
+        first LEDs of a channel changed a smaller report covering just those is sent.
+        With a transmitter running the frame is handed to it, see L{present}.
         """
+        if self._transmitter is not None:
+            self._transmitter.present()
+            return
+
         if self.r_led_count > 0:
-            self.send_data(0)
+            self._send_data(0, True)
 
         if self.g_led_count > 0:
-            self.send_data(1)
+            self._send_data(1, True)
 
         if self.b_led_count > 0:
-            self.send_data(2)
+            self._send_data(2, True)
+
+    def _channel_data(self, channel):
+        # GRB bytes to send to the channel
+        return self.data[channel]
+
+    def start_transmitter(self):
+        """
+        Send frames from a background L{FrameTransmitter} thread. Render into the
+        internal framebuffer as usual and call L{present} when a frame is complete;
+        rendering the next frame then overlaps with sending this one.
+
+        @rtype: FrameTransmitter
+        """
+        if self._transmitter is None or not self._transmitter.is_alive():
+            self._transmitter = FrameTransmitter(self)
+            self._transmitter.start()
+        return self._transmitter
+
+    def stop_transmitter(self):
+        """
+        Stop the L{FrameTransmitter} started with L{start_transmitter} after it has
+        sent the last presented frame.
+        """
+        if self._transmitter is not None:
+            self._transmitter.stop()
+            self._transmitter.join()
+            self._transmitter = None
+
+    def present(self):
+        """
+        Hand the internal framebuffer over to be sent. With a transmitter running this
+        copies the frame and returns straight away, replacing any presented frame that
+        has not been sent yet. Otherwise it is the same as L{send_data_all}.
+        """
+        if self._transmitter is None:
+            self.send_data_all()
+        else:
+            self._transmitter.present()
+
+    def _send_data(self, channel, changed_only, data=None):
+        with self._send_lock:
+            if data is None:
+                data = self._channel_data(channel)
+            size = len(data)
+
+            settings = (self.brightness, self.gamma)
+            if settings != self._sent_settings:
+                self._sent = [None, None, None]
+                self._sent_settings = settings
+
+            sent = self._sent[channel]
+            if changed_only and sent is not None and len(sent) == size:
+                if data == sent:
+                    return
+
+                # LEDs after the last changed one keep their color on the device,
+                # so the smallest report that reaches it is enough
+                view, sent_view = memoryview(data), memoryview(sent)
+                for max_leds in (8, 16, 32):
+                    if max_leds * 3 < size and view[max_leds * 3:] == sent_view[max_leds * 3:]:
+                        size = max_leds * 3
+                        break
+
+            packet_data = memoryview(data)[:size]
+
+            if self.brightness != 1.0 or self.gamma != 1.0:
+                packet_data = bytes(packet_data).translate(_color_table(255, False, self.gamma, self.brightness))
+
+            try:
+                self.bstick.set_led_data(channel, packet_data)
+                time.sleep(self.data_transmission_delay)
+            except Exception as e:
+                self._sent[channel] = None
+                print("Exception: {0}".format(e))
+                return
+
+            if sent is None or len(sent) != len(data):
+                self._sent[channel] = bytearray(data)
+            else:
+                sent[:size] = memoryview(data)[:size]
 
 class BlinkStickProMatrix(BlinkStickPro):
     """
@@ -1148,11 +1788,11 @@ class BlinkStickProMatrix(BlinkStickPro):
         self.rows = max(r_rows, g_rows, b_rows)
         self.cols = r_columns + g_columns + b_columns
 
-        # initialise data store for matrix pre-populated with zeroes
-        self.matrix_data = []
+        # initialise data store for matrix as GRB bytes pre-populated with zeroes
+        self.matrix_data = bytearray(self.rows * self.cols * 3)
 
-        for i in range(0, self.rows * self.cols):
-            self.matrix_data.append([0, 0, 0])
+        # send_data copies the columns of each channel here, every row of them
+        self.data = [bytearray(self.rows * r_columns * 3), bytearray(self.rows * g_columns * 3), bytearray(self.rows * b_columns * 3)]
 
     def set_color(self, x, y, r, g, b, remap_values=True):
         """
@@ -1173,9 +1813,14 @@ class BlinkStickProMatrix(BlinkStickPro):
         """
 
         if remap_values:
-            r, g, b = [_remap_color(val, self.max_rgb_value) for val in [r, g, b]]
+            table = _color_table(self.max_rgb_value)
+            r, g, b = _lookup_rgb(table, r, g, b)
 
-        self.matrix_data[self._coord_to_index(x, y)] = [g, r, b]
+        offset = self._coord_to_index(x, y) * 3
+        matrix_data = self.matrix_data
+        matrix_data[offset] = g
+        matrix_data[offset + 1] = r
+        matrix_data[offset + 2] = b
 
     def _coord_to_index(self, x, y):
         return y * self.cols + x
@@ -1193,8 +1838,9 @@ class BlinkStickProMatrix(BlinkStickPro):
         @return: 3-tuple for R, G and B values
         """
 
-        val = self.matrix_data[self._coord_to_index(x, y)]
-        return [val[1], val[0], val[2]]
+        offset = self._coord_to_index(x, y) * 3
+        matrix_data = self.matrix_data
+        return [matrix_data[offset + 1], matrix_data[offset], matrix_data[offset + 2]]
 
     def shift_left(self, remove=False):
         """
@@ -1203,24 +1849,7 @@ class BlinkStickProMatrix(BlinkStickPro):
         @type remove: bool
         @param remove: whether to remove the pixels on the last column or move the to the first column
         """
-        if not remove:
-            temp = []
-            for y in range(0, self.rows):
-                temp.append(self.get_color(0, y))
-
-        for y in range(0, self.rows):
-            for x in range(0, self.cols - 1):
-                r, g, b = self.get_color(x + 1, y)
-
-                self.set_color(x, y, r, g, b, False)
-
-        if remove:
-            for y in range(0, self.rows):
-                self.set_color(self.cols - 1, y, 0, 0, 0, False)
-        else:
-            for y in range(0, self.rows):
-                col = temp[y]
-                self.set_color(self.cols - 1, y, col[0], col[1], col[2], False)
+        self.scroll(-1, 0, wrap=not remove)
 
     def shift_right(self, remove=False):
         """
@@ -1229,79 +1858,173 @@ class BlinkStickProMatrix(BlinkStickPro):
         @type remove: bool
         @param remove: whether to remove the pixels on the last column or move the to the first column
         """
+        self.scroll(1, 0, wrap=not remove)
 
-        if not remove:
-            temp = []
-            for y in range(0, self.rows):
-                temp.append(self.get_color(self.cols - 1, y))
+    def shift_down(self, remove=False):
+        """
+        Shift all LED values in the matrix down
 
-        for y in range(0, self.rows):
-            for x in reversed(range(1, self.cols)):
-                r, g, b = self.get_color(x - 1, y)
-
-                self.set_color(x, y, r, g, b, False)
-
-        if remove:
-            for y in range(0, self.rows):
-                self.set_color(0, y, 0, 0, 0, False)
-        else:
-            for y in range(0, self.rows):
-                col = temp[y]
-                self.set_color(0, y, col[0], col[1], col[2], False)
+        @type remove: bool
+        @param remove: whether to remove the pixels on the last column or move the to the first column
+        """
+        self.scroll(0, 1, wrap=not remove)
 
-    def shift_down(self, remove=False):
+    def shift_up(self, remove=False):
         """
-        Shift all LED values in the matrix down
+        Shift all LED values in the matrix up
 
         @type remove: bool
         @param remove: whether to remove the pixels on the last column or move the to the first column
         """
+        self.scroll(0, -1, wrap=not remove)
 
-        if not remove:
-            temp = []
-            for x in range(0, self.cols):
-                temp.append(self.get_color(x, self.rows - 1))
+    def scroll(self, dx=0, dy=0, wrap=True):
+        """
+        Move all LED values in the matrix by several pixels in one pass.
 
-        for y in reversed(range(1, self.rows)):
-            for x in range(0, self.cols):
-                r, g, b = self.get_color(x, y - 1)
+            >>> matrix.scroll(-2, 0) # Move everything two columns to the left
+            >>> matrix.scroll(0, 1, wrap=False) # Move everything one row down
 
-                self.set_color(x, y, r, g, b, False)
+        @type dx: int
+        @param dx: columns to move right, negative to move left
+        @type dy: int
+        @param dy: rows to move down, negative to move up
+        @type wrap: bool
+        @param wrap: whether pixels moved off one edge come back on the other, otherwise the uncovered pixels are turned off
+        """
+        matrix_data = self.matrix_data
+        width = self.cols * 3
 
-        if remove:
-            for x in range(0, self.cols):
-                self.set_color(x, 0, 0, 0, 0, False)
-        else:
-            for x in range(0, self.cols):
-                col = temp[x]
-                self.set_color(x, 0, col[0], col[1], col[2], False)
+        # Rows are contiguous, so moving them is one rotation of the whole buffer
+        if dy:
+            _rotate(matrix_data, 0, len(matrix_data), dy * width, wrap)
 
-    def shift_up(self, remove=False):
+        if dx:
+            for start in range(0, len(matrix_data), width):
+                _rotate(matrix_data, start, start + width, dx * 3, wrap)
+
+    def get_array(self):
         """
-        Shift all LED values in the matrix up
+        Get the internal framebuffer as a NumPy array of shape (rows, cols, 3) in GRB
+        order. The array shares memory with the framebuffer, so whole-frame effects can
+        be drawn with array expressions and sent with L{send_data_all}.
 
-        @type remove: bool
-        @param remove: whether to remove the pixels on the last column or move the to the first column
+            >>> frame = matrix.get_array()
+            >>> frame[:, :, 1] = numpy.linspace(0, 255, matrix.cols, dtype=numpy.uint8)
+
+        Requires NumPy, which is otherwise not needed by this module.
+
+        @rtype: numpy.ndarray
+        @return: uint8 array view of the framebuffer
         """
+        try:
+            import numpy
+        except ImportError:
+            raise BlinkStickException("NumPy is required for BlinkStickProMatrix.get_array")
 
-        if not remove:
-            temp = []
-            for x in range(0, self.cols):
-                temp.append(self.get_color(x, 0))
+        return numpy.frombuffer(self.matrix_data, dtype=numpy.uint8).reshape(self.rows, self.cols, 3)
 
-        for x in range(0, self.cols):
-            for y in range(0, self.rows - 1):
-                r, g, b = self.get_color(x, y + 1)
+    def fill(self, r, g, b, remap_values=True):
+        """
+        Set every pixel in the internal framebuffer to the same color.
 
-                self.set_color(x, y, r, g, b, False)
+        @type r: int
+        @param r: red color byte
+        @type g: int
+        @param g: green color byte
+        @type b: int
+        @param b: blue color byte
+        @type remap_values: bool
+        @param remap_values: Automatically remap values based on the {max_rgb_value} supplied in the constructor
+        """
+        self.fill_rect(0, 0, self.cols - 1, self.rows - 1, r, g, b, remap_values)
 
-        if remove:
-            for x in range(0, self.cols):
-                self.set_color(x, self.rows - 1, 0, 0, 0, False)
-        else:
-            for x in range(0, self.cols):
-                col = temp[x]
-                self.set_color(x, self.rows - 1, col[0], col[1], col[2], False)
+    def fill_rect(self, x1, y1, x2, y2, r, g, b, remap_values=True):
+        """
+        Fill a rectangle with it's corners at x1:y1 and x2:y2 in the internal framebuffer.
+        Parts of the rectangle outside the matrix are ignored.
+
+        @type x1: int
+        @param x1: the x1 location in the matrix for first corner of the rectangle
+        @type y1: int
+        @param y1: the y1 location in the matrix for first corner of the rectangle
+        @type x2: int
+        @param x2: the x2 location in the matrix for second corner of the rectangle
+        @type y2: int
+        @param y2: the y2 location in the matrix for second corner of the rectangle
+        @type r: int
+        @param r: red color byte
+        @type g: int
+        @param g: green color byte
+        @type b: int
+        @param b: blue color byte
+        @type remap_values: bool
+        @param remap_values: Automatically remap values based on the {max_rgb_value} supplied in the constructor
+        """
+        if remap_values:
+            table = _color_table(self.max_rgb_value)
+            r, g, b = _lookup_rgb(table, r, g, b)
+
+        x1, x2 = max(min(x1, x2), 0), min(max(x1, x2), self.cols - 1)
+        y1, y2 = max(min(y1, y2), 0), min(max(y1, y2), self.rows - 1)
+        if x1 > x2 or y1 > y2:
+            return
+
+        row = bytes((g, r, b)) * (x2 - x1 + 1)
+        for y in range(y1, y2 + 1):
+            start = self._coord_to_index(x1, y) * 3
+            self.matrix_data[start:start + len(row)] = row
+
+    def blit(self, image, x=0, y=0, remap_values=True):
+        """
+        Copy an image into the internal framebuffer with its top left corner at x:y.
+        Parts of the image outside the matrix are ignored.
+
+        The image is either a NumPy array of shape (height, width, 3) or a list of rows
+        of (r, g, b) values, in RGB order like L{set_color}.
+
+        @type image: numpy.ndarray or list
+        @param image: the pixels to copy
+        @type x: int
+        @param x: the x location in the matrix for the left of the image
+        @type y: int
+        @param y: the y location in the matrix for the top of the image
+        @type remap_values: bool
+        @param remap_values: Automatically remap values based on the {max_rgb_value} supplied in the constructor
+        """
+        if hasattr(image, 'shape'):
+            import numpy
+
+            frame = self.get_array()
+            height, width = image.shape[:2]
+            left, top = max(x, 0), max(y, 0)
+            right, bottom = min(x + width, self.cols), min(y + height, self.rows)
+            if left >= right or top >= bottom:
+                return
+
+            pixels = numpy.asarray(image)[top - y:bottom - y, left - x:right - x][..., [1, 0, 2]]
+            pixels = numpy.clip(pixels, 0, 255).astype(numpy.uint8)
+            if remap_values:
+                pixels = numpy.frombuffer(_color_table(self.max_rgb_value), dtype=numpy.uint8)[pixels]
+            frame[top:bottom, left:right] = pixels
+            return
+
+        for row_y, row in enumerate(image, y):
+            if not 0 <= row_y < self.rows:
+                continue
+            for col_x, color in enumerate(row, x):
+                if 0 <= col_x < self.cols:
+                    self.set_color(col_x, row_y, color[0], color[1], color[2], remap_values)
+
+    def apply_brightness(self, value):
+        """
+        Scale every pixel in the internal framebuffer by value. Unlike
+        L{set_brightness} this changes the framebuffer itself.
+
+        @type value: float
+        @param value: 0.0..1.0 brightness to apply
+        """
+        self.matrix_data[:] = self.matrix_data.translate(_color_table(255, False, 1.0, value))
 
     def number(self, x, y, n, r, g, b):
         """
@@ -1461,20 +2184,10 @@ class BlinkStickProMatrix(BlinkStickPro):
         """
         Set all pixels to black in the cached matrix
         """
-        for y in range(0, self.rows):
-            for x in range(0, self.cols):
-                self.set_color(x, y, 0, 0, 0)
-
-    def send_data(self, channel):
-        """
-        Send data stored in the internal buffer to the channel.
-
-        @param channel:
-            - 0 - R pin on BlinkStick Pro board
-            - 1 - G pin on BlinkStick Pro board
-            - 2 - B pin on BlinkStick Pro board
-        """
+        _clear(self.matrix_data)
 
+    def _channel_data(self, channel):
+        # The columns of the matrix on the channel, every row of them
         start_col = 0
         end_col = 0
 
@@ -1490,20 +2203,540 @@ class BlinkStickProMatrix(BlinkStickPro):
             start_col = self.r_columns + self.g_columns
             end_col = start_col + self.b_columns
 
-        self.data[channel] = []
+        data = self.data[channel]
+        matrix_data = memoryview(self.matrix_data)
+        width = (end_col - start_col) * 3
 
         #slice the huge array to individual packets
         for y in range(0, self.rows):
-            start = y * self.cols + start_col
-            end = y * self.cols + end_col
+            start = (y * self.cols + start_col) * 3
+
+            data[y * width:(y + 1) * width] = matrix_data[start:start + width]
+
+        return data
+
+class BlinkStickProStrip(object):
+    """
+    BlinkStickProStrip drives one long virtual strip of LEDs that is split over the
+    channels of several BlinkStick Pro devices, each of which can only take 64 LEDs
+    per channel.
+
+    The strip is described as segments of (serial, channel, offset, count) in strip
+    order: the next count LEDs of the strip are LEDs offset..offset + count - 1 on that
+    channel of the BlinkStick with that serial.
+
+        >>> strip = BlinkStickProStrip([("BS000001-3.0", 0, 0, 64), ("BS000001-3.0", 1, 0, 64),
+        ...                             ("BS000002-3.0", 0, 0, 60)])
+        >>> strip.connect()
+        >>> strip.set_color(130, 255, 0, 0)
+        >>> strip.send_data_all()
+
+    Frames are drawn into one framebuffer and sent to all devices in parallel.
+    """
+
+    def __init__(self, segments, delay=0.002, max_rgb_value=255):
+        """
+        Initialize BlinkStickProStrip class.
+
+        @type segments: list
+        @param segments: (serial, channel, offset, count) for each part of the strip, or (serial, channel, count) for offset 0
+        @type delay: int
+        @param delay: default transmission delay between frames
+        @type max_rgb_value: int
+        @param max_rgb_value: maximum color value for RGB channels
+        """
+        segments = [tuple(segment) if len(segment) == 4 else (segment[0], segment[1], 0, segment[2]) for segment in segments]
+
+        # LEDs needed on each channel of each device
+        led_counts = {}
+        used = {}
+        for serial, channel, offset, count in segments:
+            if channel not in (0, 1, 2):
+                raise BlinkStickException("Channel {0} of {1} should be 0, 1 or 2".format(channel, serial))
+            if offset < 0 or count < 0:
+                raise BlinkStickException("Segment on channel {0} of {1} has a negative offset or count".format(channel, serial))
+
+            leds = used.setdefault((serial, channel), set())
+            if leds.intersection(range(offset, offset + count)):
+                raise BlinkStickException("Segments overlap on channel {0} of {1}".format(channel, serial))
+            leds.update(range(offset, offset + count))
+
+            counts = led_counts.setdefault(serial, [0, 0, 0])
+            counts[channel] = max(counts[channel], offset + count)
+            if counts[channel] > 64:
+                raise BlinkStickException("Channel {0} of {1} cannot drive more than 64 LEDs".format(channel, serial))
+
+        self.max_rgb_value = max_rgb_value
+        self.led_count = sum(segment[3] for segment in segments)
+        self.data = bytearray(self.led_count * 3)
+
+        # One BlinkStickPro per device holds the frame for its channels
+        self.devices = dict((serial, BlinkStickPro(r_led_count=counts[0], g_led_count=counts[1], b_led_count=counts[2],
+                                                   delay=delay, max_rgb_value=max_rgb_value))
+                            for serial, counts in led_counts.items())
+
+        # Where each segment of the framebuffer is copied to, worked out once here
+        self._routes = []
+        start = 0
+        for serial, channel, offset, count in segments:
+            self._routes.append((self.devices[serial].data[channel], offset * 3, (offset + count) * 3, start * 3, (start + count) * 3))
+            start += count
+
+        self._executor = None
+
+    def connect(self):
+        """
+        Connect to the BlinkSticks of all segments.
+
+        @rtype: bool
+        @return: True if every device was found
+        """
+        for serial, pro in self.devices.items():
+            pro.connect(serial)
+
+        return all(pro.bstick is not None for pro in self.devices.values())
+
+    def set_color(self, index, r, g, b, remap_values=True):
+        """
+        Set the color of a single pixel of the strip
+
+        @type index: int
+        @param index: the index of LED on the strip
+        @type r: int
+        @param r: red color byte
+        @type g: int
+        @param g: green color byte
+        @type b: int
+        @param b: blue color byte
+        @type remap_values: bool
+        @param remap_values: Automatically remap values based on the {max_rgb_value} supplied in the constructor
+        """
+        if remap_values:
+            table = _color_table(self.max_rgb_value)
+            r, g, b = _lookup_rgb(table, r, g, b)
+
+        data = self.data
+        offset = index * 3
+        data[offset] = g
+        data[offset + 1] = r
+        data[offset + 2] = b
+
+    def get_color(self, index):
+        """
+        Get the current color of a single pixel of the strip.
+
+        @type  index: int
+        @param index: the index of the LED
+
+        @rtype: (int, int, int)
+        @return: 3-tuple for R, G and B values
+        """
+        data = self.data
+        offset = index * 3
+        return [data[offset + 1], data[offset], data[offset + 2]]
+
+    def clear(self):
+        """
+        Set all pixels to black in the frame buffer.
+        """
+        _clear(self.data)
+
+    def off(self):
+        """
+        Set all pixels to black in on the devices.
+        """
+        self.clear()
+        self.send_data_all()
+
+    def set_brightness(self, value):
+        """
+        Set global brightness applied to every frame when it is sent.
+
+        @type  value: float
+        @param value: 0.0..1.0 brightness, 1.0 (default) for full brightness
+        """
+        for pro in self.devices.values():
+            pro.set_brightness(value)
+
+    def set_gamma(self, value):
+        """
+        Set gamma correction applied to every frame when it is sent.
+
+        @type  value: float
+        @param value: gamma exponent, 1.0 (default) for no correction
+        """
+        for pro in self.devices.values():
+            pro.set_gamma(value)
+
+    def send_data_all(self):
+        """
+        Send the framebuffer to all devices, each on its own thread. Like
+        L{BlinkStickPro.send_data_all} channels that did not change are skipped.
+        """
+        data = memoryview(self.data)
+        for channel_data, start, end, src_start, src_end in self._routes:
+            channel_data[start:end] = data[src_start:src_end]
+
+        pros = [pro for pro in self.devices.values() if pro.bstick is not None]
+        if len(pros) == 1:
+            pros[0].send_data_all()
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(len(self.devices), 1), thread_name_prefix="BlinkStick strip")
+        for future in [self._executor.submit(pro.send_data_all) for pro in pros]:
+            future.result()
+
+class Fade(object):
+    """
+    Deadlines and colors for one fade between two colors, shared by the effects of
+    L{BlinkStick} and blinkstick_async, which only differ in how they wait.
+
+    Each step is due at its deadline from started, so transfer time does not stretch
+    the fade. Late steps are skipped rather than queued, the color sent is always the
+    one due now, and fewer steps are planned when the device cannot take the requested
+    number within duration:
+
+        >>> fade = bstick.plan_fade(start, end, 1000, 50, time.monotonic())
+        >>> for deadline in fade:
+        ...     wait_until(deadline)
+        ...     color = fade.color_due(time.monotonic())
+        ...     if color is not None:
+        ...         bstick.set_color(red=color[0], green=color[1], blue=color[2])
+        ...         fade.sent(time.monotonic())
+        >>> wait_until(fade.last_deadline())
+        >>> bstick.set_color(red=end[0], green=end[1], blue=end[2])
+    """
+
+    def __init__(self, bstick, start, end, duration, steps, started):
+        self.bstick = bstick
+        self.start = start
+        self.end = end
+        self.started = started
+        self.seconds = float(duration) / 1000
+        self.finished = started + self.seconds
+        self.steps = _effect_steps(steps, self.seconds, bstick._send_time)
+        self.interval = self.seconds / (self.steps + 1)
+        self._step = 1
+        self._sending = None
+
+    def __iter__(self):
+        while self._step <= self.steps:
+            yield self.started + self._step * self.interval
+
+    def color_due(self, now):
+        """
+        Get the color to send at now, or None when the fade is too close to its end for
+        another step and should go straight to the last one.
+
+        @rtype: (float, float, float)
+        """
+        if now + 2 * self.bstick._send_time >= self.finished:
+            self._step = self.steps + 1
+            return None
+
+        self._sending = now
+        d = (now - self.started) / self.seconds
+        return tuple((s * (1 - d)) + (e * d) for s, e in zip(self.start, self.end))
+
+    def sent(self, now):
+        """
+        Record that the color from L{color_due} has been sent, to time the device's
+        transfers and skip the steps that are already late.
+        """
+        self.bstick._send_time = _average(self.bstick._send_time, now - self._sending)
+        self._step = max(self._step + 1, int((now - self.started) / self.interval) + 1)
+
+    def last_deadline(self):
+        """
+        Get when to start sending the end color so that it lands on L{finished}.
+
+        @rtype: float
+        """
+        return self.finished - self.bstick._send_time
+
+class FrameTransmitter(threading.Thread):
+    """
+    Background thread that sends the frames a L{BlinkStickPro} presents, see
+    L{BlinkStickPro.start_transmitter}.
+
+    Only the latest presented frame is kept: when the device is slower than the
+    renderer, frames are dropped rather than queued, so what is shown never lags
+    behind by more than one frame.
+    """
+
+    def __init__(self, pro):
+        super(FrameTransmitter, self).__init__(name="BlinkStick frame transmitter")
+        self.daemon = True
+        self.pro = pro
+        self.frames_presented = 0
+        self.frames_sent = 0
+        # The presented frame and the one being sent, swapped when a new frame is picked up
+        self._front = [bytearray(len(data)) for data in pro.data]
+        self._sending = [bytearray(len(data)) for data in pro.data]
+        self._pending = False
+        self._stopped = False
+        self._ready = threading.Condition()
+
+    def present(self):
+        counts = (self.pro.r_led_count, self.pro.g_led_count, self.pro.b_led_count)
+        with self._ready:
+            for channel, count in enumerate(counts):
+                if count > 0:
+                    self._front[channel][:] = self.pro._channel_data(channel)
+            self._pending = True
+            self.frames_presented += 1
+            self._ready.notify()
+
+    def run(self):
+        counts = (self.pro.r_led_count, self.pro.g_led_count, self.pro.b_led_count)
+        while True:
+            with self._ready:
+                while not self._pending and not self._stopped:
+                    self._ready.wait()
+                if not self._pending:
+                    return
+                self._front, self._sending = self._sending, self._front
+                self._pending = False
+
+            for channel, count in enumerate(counts):
+                if count > 0:
+                    self.pro._send_data(channel, True, self._sending[channel])
+            self.frames_sent += 1
+
+    def stop(self):
+        with self._ready:
+            self._stopped = True
+            self._ready.notify()
+
+_mock_devices = []
+
+def add_mock_device(serial=None, latency=0.0):
+    """
+    Attach an in-memory L{MockTransport} device that L{find_all}, L{find_first} and
+    L{find_by_serial} will return ahead of any real BlinkStick.
+
+    Setting the BLINKSTICK_MOCK_DEVICES environment variable to a number attaches that
+    many mock devices the first time one of the find functions runs.
+
+    @type  serial: str
+    @param serial: serial number for the device, defaults to BS00000n-3.0
+    @type  latency: float
+    @param latency: seconds each transfer takes
+    @rtype: MockTransport
+    @return: the mock device, to inspect its state or unplug it
+    """
+    if serial is None:
+        serial = "BS%06d-3.0" % (len(_mock_devices) + 1)
+
+    device = MockTransport(serial=serial, latency=latency)
+    _mock_devices.append(device)
+    return device
+
+def remove_mock_devices():
+    """
+    Detach all devices added with L{add_mock_device}.
+    """
+    del _mock_devices[:]
+
+def _transport_for(device):
+    if isinstance(device, BlinkStickTransport):
+        return device
+    elif sys.platform == "win32":
+        return HidTransport(device)
+    else:
+        return UsbTransport(device)
+
+def _device_serial(device):
+    if isinstance(device, BlinkStickTransport):
+        return device.get_string(3)
+    elif sys.platform == "win32":
+        return device.serial_number
+    else:
+        return usb.util.get_string(device, 3)
+
+class DeviceRegistry(object):
+    """
+    Process-wide map of BlinkStick serial numbers to device handles.
+
+    L{refresh} scans the bus and only reads the serial number of devices it has not seen
+    before, so looking a device up again after a USB error costs one bus scan instead of
+    a string descriptor read from every attached BlinkStick.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # device key -> (serial, device handle)
+        self._devices = {}
+        # serial -> device handle
+        self._by_serial = {}
+        # serial -> number of times the device was found after being absent
+        self._appearances = {}
+
+    def refresh(self):
+        """
+        Scan for devices and update the registry with the ones that came and went.
+
+        @rtype: list
+        @return: the device handles currently attached
+        """
+        found = [(_device_key(d), d) for d in _find_blicksticks()]
+
+        with self._lock:
+            known = dict(self._devices)
+
+        # Only new devices need their serial read, and that happens outside the lock
+        # so lookups for other devices carry on meanwhile
+        current = {}
+        for key, d in found:
+            if key in known:
+                current[key] = known[key]
+            else:
+                try:
+                    current[key] = (_device_serial(d), d)
+                except Exception as e:
+                    print("{0}".format(e))
+
+        with self._lock:
+            self._devices = current
+            by_serial = dict(current.values())
+            for serial in by_serial:
+                if serial not in self._by_serial:
+                    self._appearances[serial] = self._appearances.get(serial, 0) + 1
+            self._by_serial = by_serial
+
+        return [current[key][1] for key, d in found if key in current]
+
+    def get(self, serial):
+        """
+        Get the device handle for serial from the last L{refresh}.
+
+        @rtype: device or None
+        """
+        with self._lock:
+            return self._by_serial.get(serial)
+
+    def serial_of(self, device):
+        """
+        Get the serial number of a device handle seen by the last L{refresh}.
+
+        @rtype: str or None
+        """
+        with self._lock:
+            entry = self._devices.get(_device_key(device))
+        if entry:
+            return entry[0]
+
+    def appearances(self, serial):
+        """
+        Get how many times serial has been found after being absent, which goes up when
+        a device is plugged back in.
+
+        @rtype: int
+        """
+        with self._lock:
+            return self._appearances.get(serial, 0)
 
-            self.data[channel].extend(self.matrix_data[start: end])
+    def serials(self):
+        """
+        @rtype: list
+        @return: serial numbers of the devices seen by the last L{refresh}
+        """
+        with self._lock:
+            return list(self._by_serial)
 
-        super(BlinkStickProMatrix, self).send_data(channel)
+    def find(self, serial):
+        """
+        Refresh the registry and get the device handle for serial.
+
+        @rtype: device or None
+        """
+        self.refresh()
+        return self.get(serial)
+
+_registry = DeviceRegistry()
+
+def get_registry():
+    """
+    Get the process-wide L{DeviceRegistry}.
+    """
+    return _registry
+
+class HotplugMonitor(threading.Thread):
+    """
+    Background thread that refreshes the L{DeviceRegistry} every interval seconds, so
+    BlinkSticks that are reconnecting notice as soon as their device is plugged back in.
+    """
+
+    def __init__(self, interval=1.0):
+        super(HotplugMonitor, self).__init__(name="BlinkStick hotplug monitor")
+        self.daemon = True
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        last_error = None
+        while not self._stopped.wait(self.interval):
+            try:
+                _registry.refresh()
+            except Exception as e:
+                # Report a failure once rather than on every scan while it lasts
+                error = "{0}".format(e)
+                if error != last_error:
+                    print(error)
+                last_error = error
+            else:
+                last_error = None
+
+    def stop(self):
+        self._stopped.set()
+
+_hotplug_monitor = None
+
+def start_hotplug_monitor(interval=1.0):
+    """
+    Start the L{HotplugMonitor} thread if it is not running yet.
+
+    @type  interval: float
+    @param interval: seconds between bus scans
+    @rtype: HotplugMonitor
+    """
+    global _hotplug_monitor
+
+    if _hotplug_monitor is None or not _hotplug_monitor.is_alive():
+        _hotplug_monitor = HotplugMonitor(interval)
+        _hotplug_monitor.start()
+    return _hotplug_monitor
+
+def stop_hotplug_monitor():
+    """
+    Stop the L{HotplugMonitor} thread started with L{start_hotplug_monitor}.
+    """
+    global _hotplug_monitor
+
+    if _hotplug_monitor is not None:
+        _hotplug_monitor.stop()
+        _hotplug_monitor = None
+
+def _device_key(device):
+    if isinstance(device, BlinkStickTransport):
+        return id(device)
+    elif sys.platform == "win32":
+        return device.device_path
+    else:
+        return (device.bus, device.address)
 
 def _find_blicksticks(find_all=True):
+    if not _mock_devices and os.environ.get("BLINKSTICK_MOCK_DEVICES"):
+        for i in range(int(os.environ["BLINKSTICK_MOCK_DEVICES"])):
+            add_mock_device()
+
+    devices = [d for d in _mock_devices if d.connected]
+    if devices and not find_all:
+        return devices[0]
+
     if sys.platform == "win32":
-        devices = hid.HidDeviceFilter(vendor_id = VENDOR_ID, product_id = PRODUCT_ID).get_devices()
+        devices.extend(hid.HidDeviceFilter(vendor_id = VENDOR_ID, product_id = PRODUCT_ID).get_devices())
         if find_all:
             return devices
         elif len(devices) > 0:
@@ -1512,7 +2745,19 @@ def _find_blicksticks(find_all=True):
             return None
 
     else:
-        return usb.core.find(find_all=find_all, idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
+        try:
+            found = usb.core.find(find_all=find_all, idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
+        except usb.core.NoBackendError:
+            # No libusb, which is fine when only mock devices are used
+            if not _mock_devices:
+                raise
+            found = [] if find_all else None
+
+        if find_all:
+            devices.extend(found)
+            return devices
+        else:
+            return found
 
 
 def find_all():
@@ -1523,7 +2768,7 @@ def find_all():
     @return: a list of BlinkStick objects or None if no devices found
     """
     result = []
-    for d in _find_blicksticks():
+    for d in _registry.refresh():
         result.extend([BlinkStick(device=d)])
 
     return result
@@ -1550,46 +2795,109 @@ def find_by_serial(serial=None):
     @return: BlinkStick object or None if no devices are found
     """
 
-    devices = []
-    if sys.platform == "win32":
-        devices = [d for d in _find_blicksticks()
-                   if d.serial_number == serial]
-    else:
-        for d in _find_blicksticks():
-            try:
-                if usb.util.get_string(d, 3) == serial:
-                    devices = [d]
-                    break
-            except Exception as e:
-                print("{0}".format(e))
-
-    if devices:
-        return BlinkStick(device=devices[0])
-
-
-def _remap(value, leftMin, leftMax, rightMin, rightMax):
-    # Figure out how 'wide' each range is
-    leftSpan = leftMax - leftMin
-    rightSpan = rightMax - rightMin
+    d = _registry.find(serial)
 
-    # Convert the left range into a 0-1 range (float)
-    valueScaled = float(value - leftMin) / float(leftSpan)
-
-    # Convert the 0-1 range into a value in the right range.
-    return int(rightMin + (valueScaled * rightSpan))
-
-def _remap_color(value, max_value):
-    return _remap(value, 0, 255, 0, max_value)
+    if d:
+        return BlinkStick(device=d)
 
-def _remap_color_reverse(value, max_value):
-    return _remap(value, 0, max_value, 0, 255)
 
-def _remap_rgb_value(rgb_val, max_value):
-    return [_remap_color(rgb_val[0], max_value),
-        _remap_color(rgb_val[1], max_value),
-        _remap_color(rgb_val[2], max_value)]
+def _rotate(buffer, start, end, offset, wrap):
+    # Move buffer[start:end] by offset bytes towards its end, either wrapping
+    # around or filling the uncovered bytes with zeros
+    size = end - start
+    if size <= 0:
+        return
+
+    if wrap:
+        offset %= size
+        if offset:
+            buffer[start:end] = buffer[end - offset:end] + buffer[start:end - offset]
+    elif abs(offset) >= size:
+        buffer[start:end] = bytes(size)
+    elif offset > 0:
+        buffer[start + offset:end] = buffer[start:end - offset]
+        buffer[start:start + offset] = bytes(offset)
+    elif offset < 0:
+        buffer[start:end + offset] = buffer[start - offset:end]
+        buffer[end + offset:end] = bytes(-offset)
+
+def _clear(buffer):
+    # Zero a bytearray in place
+    size = len(buffer)
+    buffer[:] = _ZEROS[:size] if size <= len(_ZEROS) else bytes(size)
+
+def _average(average, sample):
+    # Smoothed transfer time, seeded by the first sample
+    return average * 0.75 + sample * 0.25 if average else sample
+
+def _sleep_until(deadline):
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def _effect_steps(steps, seconds, send_time):
+    # Limit steps to the transfers that fit into seconds at the measured send time
+    if send_time > 0:
+        steps = min(steps, int(seconds / send_time) - 1)
+    return max(steps, 0)
+
+@functools.lru_cache(maxsize=256)
+def _hex_to_rgb(hex_value):
+    # Parsing behind BlinkStick._hex_to_rgb, remembered for the most recent colors
+    match = BlinkStick.HEX_COLOR_RE.match(hex_value)
+    if match is None:
+        raise ValueError("'%s' is not a valid hexadecimal color value." % hex_value)
+
+    hex_digits = match.group(1)
+    if len(hex_digits) == 3:
+        hex_digits = ''.join([2 * s for s in hex_digits])
+
+    value = int(hex_digits, 16)
+    return (value >> 16, (value >> 8) & 0xff, value & 0xff)
+
+def _lookup_rgb(table, red, green, blue):
+    # Table entries for a color, with values outside 0..255 clamped rather than wrapped
+    return (table[min(max(int(round(red, 3)), 0), 255)],
+            table[min(max(int(round(green, 3)), 0), 255)],
+            table[min(max(int(round(blue, 3)), 0), 255)])
+
+@functools.lru_cache(maxsize=32)
+def _color_table(max_rgb_value=255, inverse=False, gamma=1.0, brightness=1.0):
+    # 256 entry table from a 0..255 color value to the byte sent to the device
+    table = bytearray(256)
+    for value in range(256):
+        level = (float(value) / 255) ** gamma * brightness
+        byte = min(int(level * max_rgb_value), 255)
+        table[value] = 255 - byte if inverse else byte
+
+    return bytes(table)
+
+@functools.lru_cache(maxsize=32)
+def _reverse_color_table(max_rgb_value=255, inverse=False, gamma=1.0, brightness=1.0):
+    # 256 entry table from a device byte back to the smallest color value whose
+    # byte is closest to it, the reverse of _color_table
+    table = _color_table(max_rgb_value, inverse, gamma, brightness)
+
+    exact = [None] * 256
+    for value in range(255, -1, -1):
+        exact[table[value]] = value
+
+    # Nearest byte with an exact match below and above each byte
+    below = [None] * 256
+    nearest = None
+    for byte in range(256):
+        if exact[byte] is not None:
+            nearest = byte
+        below[byte] = nearest
+
+    reverse_table = bytearray(256)
+    nearest = None
+    for byte in range(255, -1, -1):
+        if exact[byte] is not None:
+            nearest = byte
+        candidates = [b for b in (below[byte], nearest) if b is not None]
+        distance = min(abs(b - byte) for b in candidates)
+        reverse_table[byte] = min(exact[b] for b in candidates if abs(b - byte) == distance)
+
+    return bytes(reverse_table)
 
-def _remap_rgb_value_reverse(rgb_val, max_value):
-    return [_remap_color_reverse(rgb_val[0], max_value),
-        _remap_color_reverse(rgb_val[1], max_value),
-        _remap_color_reverse(rgb_val[2], max_value)]
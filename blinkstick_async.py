@@ -0,0 +1,207 @@
+# asyncio interface for BlinkStick devices
+# Copyright (C) 2019  Stephanie Hobson
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+asyncio wrappers around L{blinkstick.BlinkStick}.
+
+USB transfers still block, so they run on a bounded thread pool shared by all devices.
+Transfers to the same device are serialized, transfers to different devices overlap,
+and the effects wait with asyncio.sleep so one event loop can drive many sticks.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import blinkstick
+
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """
+    Get the thread pool transfers run on, creating it with DEFAULT_MAX_WORKERS threads
+    the first time.
+
+    @rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="blinkstick")
+        return _executor
+
+
+class AsyncBlinkStick(object):
+    """
+    Awaitable version of a L{blinkstick.BlinkStick}.
+
+        >>> stick = (await find_all())[0]
+        >>> await stick.set_color(red=255)
+        >>> await stick.morph(name="blue", duration=1000)
+    """
+
+    def __init__(self, bstick, executor=None):
+        """
+        @type  bstick: blinkstick.BlinkStick
+        @param bstick: the device to wrap
+        @type  executor: concurrent.futures.Executor
+        @param executor: where to run transfers, defaults to the shared L{get_executor} pool
+        """
+        self.bstick = bstick
+        self.executor = executor
+        self._lock = asyncio.Lock()
+
+    async def _run(self, func, *args, **kwargs):
+        # One transfer at a time per device, in the thread pool
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor or get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def set_color(self, channel=0, index=0, red=0, green=0, blue=0, name=None, hex=None):
+        """
+        Awaitable L{blinkstick.BlinkStick.set_color}.
+        """
+        await self._run(self.bstick.set_color, channel=channel, index=index, red=red, green=green, blue=blue, name=name, hex=hex)
+
+    async def set_colors(self, channel, colors):
+        """
+        Awaitable L{blinkstick.BlinkStick.set_colors}.
+        """
+        await self._run(self.bstick.set_colors, channel, colors)
+
+    async def set_led_data(self, channel, data):
+        """
+        Awaitable L{blinkstick.BlinkStick.set_led_data}.
+        """
+        await self._run(self.bstick.set_led_data, channel, data)
+
+    async def get_color(self, index=0, color_format='rgb', refresh=False):
+        """
+        Awaitable L{blinkstick.BlinkStick.get_color}.
+        """
+        return await self._run(self.bstick.get_color, index=index, color_format=color_format, refresh=refresh)
+
+    async def turn_off(self):
+        await self.set_color()
+
+    async def morph(self, channel=0, index=0, red=0, green=0, blue=0, name=None, hex=None, duration=1000, steps=50):
+        """
+        Morph to the specified color, see L{blinkstick.BlinkStick.morph}.
+
+        Each step is shown at its deadline from the start of the morph, so transfer time
+        does not add to duration. Steps that are already late are skipped, and fewer
+        steps are used when the device cannot keep up with the requested number.
+        """
+        started = time.monotonic()
+
+        end = self.bstick.parse_color(red=red, green=green, blue=blue, name=name, hex=hex)
+        start = await self._run(self.bstick.get_morph_start, channel, index)
+
+        await self._fade(channel, index, start, end, duration, steps, started)
+
+    async def _fade(self, channel, index, start, end, duration, steps, started):
+        # blinkstick.BlinkStick._fade, waiting with asyncio.sleep
+        fade = self.bstick.plan_fade(start, end, duration, steps, started)
+
+        for deadline in fade:
+            await _sleep_until(deadline)
+            color = fade.color_due(time.monotonic())
+            if color is not None:
+                await self.set_color(channel=channel, index=index, red=color[0], green=color[1], blue=color[2])
+                fade.sent(time.monotonic())
+
+        await _sleep_until(fade.last_deadline())
+        await self.set_color(channel=channel, index=index, red=end[0], green=end[1], blue=end[2])
+
+        return fade.finished
+
+    async def pulse(self, channel=0, index=0, red=0, green=0, blue=0, name=None, hex=None, repeats=1, duration=1000, steps=50):
+        """
+        Morph to the specified color from black and back again, see L{blinkstick.BlinkStick.pulse}.
+        """
+        r, g, b = self.bstick.parse_color(red=red, green=green, blue=blue, name=name, hex=hex)
+
+        deadline = time.monotonic()
+        await self.turn_off()
+        for x in range(repeats):
+            deadline = await self._fade(channel, index, (0, 0, 0), (r, g, b), duration, steps, deadline)
+            deadline = await self._fade(channel, index, (r, g, b), (0, 0, 0), duration, steps, deadline)
+
+    async def blink(self, channel=0, index=0, red=0, green=0, blue=0, name=None, hex=None, repeats=1, delay=500):
+        """
+        Blink the specified color, see L{blinkstick.BlinkStick.blink}.
+
+        The on and off times are measured from the start of the blink, not from the end
+        of each transfer.
+        """
+        r, g, b = self.bstick.parse_color(red=red, green=green, blue=blue, name=name, hex=hex)
+        ms_delay = float(delay) / float(1000)
+        started = time.monotonic()
+
+        for x in range(repeats):
+            await _sleep_until(started + 2 * x * ms_delay)
+            await self.set_color(channel=channel, index=index, red=r, green=g, blue=b)
+            await _sleep_until(started + (2 * x + 1) * ms_delay)
+            await self.set_color(channel=channel, index=index)
+
+
+async def _sleep_until(deadline):
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def find_all(executor=None):
+    """
+    Find all attached BlinkStick devices without blocking the event loop.
+
+    @rtype: AsyncBlinkStick[]
+    """
+    loop = asyncio.get_running_loop()
+    bsticks = await loop.run_in_executor(executor or get_executor(), blinkstick.find_all)
+    return [AsyncBlinkStick(bstick, executor) for bstick in bsticks]
+
+
+async def find_first(executor=None):
+    """
+    Find the first attached BlinkStick without blocking the event loop.
+
+    @rtype: AsyncBlinkStick
+    @return: AsyncBlinkStick object or None if no devices are found
+    """
+    loop = asyncio.get_running_loop()
+    bstick = await loop.run_in_executor(executor or get_executor(), blinkstick.find_first)
+    if bstick:
+        return AsyncBlinkStick(bstick, executor)
+
+
+async def find_by_serial(serial=None, executor=None):
+    """
+    Find a BlinkStick by serial number without blocking the event loop.
+
+    @rtype: AsyncBlinkStick
+    @return: AsyncBlinkStick object or None if no devices are found
+    """
+    loop = asyncio.get_running_loop()
+    bstick = await loop.run_in_executor(executor or get_executor(), blinkstick.find_by_serial, serial)
+    if bstick:
+        return AsyncBlinkStick(bstick, executor)
@@ -15,9 +15,30 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import datetime, argparse, random, time
-import blinkstick
-import usb
+import datetime, argparse, random, time, math, bisect, array, hashlib, mmap, os, sys, json, struct, threading
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# Wake up just after the color is due to change, not just before
+CHANGE_MARGIN = 0.01
+# How soon the daemon retries sticks that failed
+RETRY_SLEEP = 5
+# Longest the daemon sleeps, and how often it scans the bus for sticks that were
+# plugged in: once a minute, like the cron job it replaces
+HOTPLUG_SLEEP = 60
+# Bump when the day table layout or interpolation changes
+DAY_TABLE_VERSION = b'nightfall-day-table-1'
+# Compiled --schedule files are cached next to the source as <file>.cache:
+# header (magic, source mtime_ns, source size, source sha1, profile count) then for each
+# profile (name length, entry count, name, int32 little-endian times, packed RGB)
+SCHEDULE_CACHE_SUFFIX = '.cache'
+SCHEDULE_CACHE_MAGIC = b'NFS1'
+SCHEDULE_CACHE_HEADER = struct.Struct('<4sqq20sH')
+SCHEDULE_CACHE_PROFILE = struct.Struct('<HI')
+# --simulate --format binary header: magic, first frame as unix time, seconds between frames
+SIMULATION_MAGIC = b'NFSM'
+SIMULATION_HEADER = struct.Struct('<4sdd')
+# --simulate CSV text for each color byte
+SIMULATION_DECIMALS = tuple(str(value) for value in range(256))
 
 def get_step_color(from_color, to_color, transition_duration, transition_progress, verbose):
     transition_range =  to_color - from_color
@@ -36,10 +57,85 @@ def get_step_color(from_color, to_color, transition_duration, transition_progres
     new_color = from_color + current_step
     return new_color
 
-def christmas_light_mode(bstick, verbose=False):
+class FrameScheduler(object):
+    """
+    Plays a list of frames at a target frame rate against monotonic deadlines, so slow
+    transfers don't stretch the total duration. When it falls more than a frame behind
+    it skips ahead to the frame that is due, but always shows the last one.
+    """
+
+    def __init__(self, fps):
+        if fps <= 0:
+            raise ValueError('fps must be more than 0')
+        self.interval = 1.0 / fps
+        self.frames_shown = 0
+        self.late_frames = 0
+        self.skipped_frames = 0
+        self.elapsed = 0.0
+
+    def fade_frames(self, from_color, to_color, duration):
+        """
+        Precompute the (red, green, blue) frames for a fade lasting duration seconds
+        """
+        steps = max(int(round(duration / self.interval)), 1)
+        frames = []
+        for step in range(steps + 1):
+            progress = min(step * self.interval, duration)
+            frames.append(tuple(int(get_step_color(from_color[channel], to_color[channel], duration, progress, False))
+                                for channel in range(3)))
+        return frames
+
+    def play(self, frames, show, stop=None):
+        """
+        Call show(frame) for each frame at its deadline, returns the number of frames shown.
+        Stops early once the stop event (a threading.Event) is set.
+        """
+        start = time.monotonic()
+        last = len(frames) - 1
+        shown = 0
+        index = 0
+        while index <= last:
+            if stop is not None and stop.is_set():
+                break
+            deadline = start + index * self.interval
+            now = time.monotonic()
+            if now < deadline:
+                if stop is None:
+                    time.sleep(deadline - now)
+                elif stop.wait(deadline - now):
+                    break
+            elif now - deadline >= self.interval:
+                # More than a frame behind, jump to the frame that is due now
+                due = min(int((now - start) / self.interval), last)
+                self.skipped_frames += due - index
+                index = due
+                self.late_frames += 1
+            elif now - deadline > self.interval / 2:
+                self.late_frames += 1
+
+            show(frames[index])
+            shown += 1
+            index += 1
+
+        self.frames_shown += shown
+        self.elapsed += time.monotonic() - start
+        return shown
+
+    def achieved_fps(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.frames_shown / self.elapsed
+
+def christmas_light_mode(bstick, verbose=False, fps=10, stop=None):
     """
     Christmas light mode: randomly cycles through festive colors with smooth transitions
+    until Ctrl+C or until the stop event (a threading.Event) is set
     """
+    import blinkstick, usb
+
+    if stop is None:
+        stop = threading.Event()
+
     christmas_colors = [
         [255, 0, 0],      # Red
         [0, 255, 0],      # Green
@@ -54,15 +150,25 @@ def christmas_light_mode(bstick, verbose=False):
     
     fade_duration = 5  # seconds to fade between colors
     hold_duration = 20  # seconds to hold the color
-    update_interval = 0.1  # seconds between updates (smoother = smaller value)
     
     current_color = [0, 0, 0]  # Start from off
+
+    # Fade steps that round to the color already showing don't need sending
+    bstick.set_write_cache(True)
+
+    def show(frame):
+        try:
+            bstick.set_color(channel=0, index=0, red=frame[0], green=frame[1], blue=frame[2])
+        except (usb.USBError, blinkstick.BlinkStickException) as e:
+            # A missing stick fails fast, so the fade keeps its timing
+            if verbose:
+                print(f"USB error: {e}")
     
     if verbose:
         print("Starting Christmas light mode (Press Ctrl+C to stop)")
     
     try:
-        while True:
+        while not stop.is_set():
             # Pick a random target color different from the current one
             target_color = random.choice(christmas_colors)
             while target_color == current_color:
@@ -71,73 +177,452 @@ def christmas_light_mode(bstick, verbose=False):
             if verbose:
                 print(f"Transitioning to {target_color}")
             
-            # Fade to the new color
-            steps = int(fade_duration / update_interval)
-            for step in range(steps + 1):
-                red = get_step_color(current_color[0], target_color[0], fade_duration, step * update_interval, False)
-                green = get_step_color(current_color[1], target_color[1], fade_duration, step * update_interval, False)
-                blue = get_step_color(current_color[2], target_color[2], fade_duration, step * update_interval, False)
-                
-                try:
-                    bstick.set_color(channel=0, index=0, red=int(red), green=int(green), blue=int(blue))
-                except usb.USBError as e:
-                    if verbose:
-                        print(f"USB error: {e}")
-                
-                time.sleep(update_interval)
+            # Fade to the new color (smoother = higher fps)
+            scheduler = FrameScheduler(fps)
+            scheduler.play(scheduler.fade_frames(current_color, target_color, fade_duration), show, stop)
+            hold_until = time.monotonic() + hold_duration
             
             # Update current color to target
             current_color = target_color
             
             if verbose:
+                print(f"Faded in {scheduler.elapsed:.2f} seconds at {scheduler.achieved_fps():.1f} fps "
+                      f"({scheduler.late_frames} late, {scheduler.skipped_frames} skipped)")
                 print(f"Holding color for {hold_duration} seconds")
             
             # Hold the color
-            time.sleep(hold_duration)
+            stop.wait(max(hold_until - time.monotonic(), 0))
             
     except KeyboardInterrupt:
+        pass
+
+    if verbose:
+        print("\nChristmas mode stopped")
+    # Turn off the light
+    bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
+
+def seconds_since_midnight(t):
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1000000
+
+def format_seconds(seconds):
+    whole = int(seconds)
+    text = '%02d:%02d:%02d' % (whole // 3600, whole // 60 % 60, whole % 60)
+    if seconds != whole:
+        text += ('%.3f' % (seconds - whole))[1:]
+    return text
+
+class Schedule(object):
+    """
+    A list of {'time', 'color'} schedule entries compiled once into sorted
+    seconds-since-midnight and packed RGB arrays, so the color for any time
+    of day is a binary search away.
+    """
+
+    def __init__(self, colors):
+        entries = []
+        for entry in colors:
+            entry_time = entry['time']
+            if isinstance(entry_time, str):
+                entry_time = datetime.datetime.strptime(entry_time, '%H:%M:%S').time()
+            elif not isinstance(entry_time, datetime.time):
+                raise ValueError("time should be an 'HH:MM:SS' string or a time of day, not %r" % (entry_time,))
+            color = entry['color']
+            if (not isinstance(color, (list, tuple)) or len(color) != 3 or
+                    not all(isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 255 for c in color)):
+                raise ValueError('color at %s should be three integers from 0 to 255, not %r' % (entry['time'], color))
+            entries.append((int(seconds_since_midnight(entry_time)), color))
+        if not entries:
+            raise ValueError('A schedule needs at least one entry')
+        entries.sort(key=lambda entry: entry[0])
+
+        self.times = array.array('l', [entry[0] for entry in entries])
+        self.rgb = array.array('B')
+        for entry_time, color in entries:
+            self.rgb.extend(color)
+
+        self.day_table = None
+
+    @classmethod
+    def from_arrays(cls, times, rgb):
+        """
+        Build a Schedule from already compiled, sorted times and packed RGB arrays
+        """
+        schedule = cls.__new__(cls)
+        schedule.times = array.array('l', times)
+        schedule.rgb = array.array('B', rgb)
+        schedule.day_table = None
+        return schedule
+
+    def __len__(self):
+        return len(self.times)
+
+    def entry_color(self, index):
+        return self.rgb[index * 3:index * 3 + 3]
+
+    def find_transition(self, seconds):
+        """
+        Find the entries either side of seconds, returns (from_index, to_index)
+        """
+        # Always resolve a color and time, even if seconds is outside the defined ranges
+        index = bisect.bisect_right(self.times, seconds)
+        if index == 0:
+            return 0, 0
+        if index == len(self.times):
+            # After the last color, use the last color for both from and to
+            return index - 1, index - 1
+        return index - 1, index
+
+    def color_at(self, seconds, verbose=False):
+        """
+        Resolve the (red, green, blue) color for seconds since midnight
+        """
+        from_index, to_index = self.find_transition(seconds)
+        from_color = self.entry_color(from_index)
+        to_color = self.entry_color(to_index)
+        if verbose and to_index != from_index:
+            print('next time ' + format_seconds(self.times[to_index]))
+
+        transition_duration = self.times[to_index] - self.times[from_index]
+        transition_progress = seconds - self.times[from_index]
         if verbose:
-            print("\nChristmas mode stopped")
-        # Turn off the light
-        bstick.set_color(channel=0, index=0, red=0, green=0, blue=0)
-
-parser = argparse.ArgumentParser(description='Visual indication of time using blinkstick')
-parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
-                    help='suppress normal output')
-parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
-                    help='enable extra debugging output')
-parser.add_argument('-t', '--time', dest='time',
-                    type=str,
-                    help='UTC formated time (e.g. 20:07:00)')
-parser.add_argument('-d', '--day', dest='day',
-                    type=int, choices=range(0, 7),
-                    help='Day of the week (0=Monday, 1=Tuesday, 2=Wednesday, 3=Thursday, 4=Friday, 5=Saturday, 6=Sunday)')
-parser.add_argument('--christmas', dest='christmas', action='store_true',
-                    help='enable Christmas light mode (random color cycling)')
-args = parser.parse_args()
-
-if not args.quiet or args.verbose:
-    print("Starting...")
-
-if args.time:
-    current_time = datetime.datetime.strptime(args.time, '%H:%M:%S').time()
-    # Use today's date for weekday check even with custom time
-    current_date = datetime.datetime.today()
-else:
-    current_date = datetime.datetime.today()
-    current_time = current_date.time()
-
-# Override the day of week if specified
-if args.day is not None:
-    # Calculate the offset to the desired day
-    current_weekday = current_date.weekday()
-    days_offset = args.day - current_weekday
-    current_date = current_date + datetime.timedelta(days=days_offset)
-
-if not args.quiet or args.verbose:
-    print('current time:' + str(current_time))
-    print('day of week: %s (%d)' % (current_date.strftime('%A'), current_date.weekday()))
+            print(str(transition_progress))
+
+        if verbose:
+            print('red:')
+        red = get_step_color(from_color[0], to_color[0], transition_duration, transition_progress, verbose)
+        if verbose:
+            print('green:')
+        green = get_step_color(from_color[1], to_color[1], transition_duration, transition_progress, verbose)
+        if verbose:
+            print('blue:')
+        blue = get_step_color(from_color[2], to_color[2], transition_duration, transition_progress, verbose)
+
+        return red, green, blue
+
+    def colors_at(self, seconds_list):
+        """
+        Resolve colors for many times at once, returns a list of (red, green, blue)
+        """
+        return [self.color_at(seconds) for seconds in seconds_list]
+
+    def seconds_until_change(self, seconds):
+        """
+        Work out how many seconds the color resolved for seconds will stay the same
+        """
+        from_index, to_index = self.find_transition(seconds)
+        start = self.times[from_index]
+        end = self.times[to_index]
+
+        if end <= seconds:
+            # Past the last entry nothing changes until the day starts over
+            return SECONDS_PER_DAY - seconds
+
+        wait = end - seconds
+        duration = end - start
+        if duration > 0:
+            from_color = self.entry_color(from_index)
+            to_color = self.entry_color(to_index)
+            for channel in range(3):
+                transition_range = to_color[channel] - from_color[channel]
+                if transition_range == 0:
+                    continue
+                slope = transition_range / duration
+                value = get_step_color(from_color[channel], to_color[channel], duration, seconds - start, False)
+                # The device gets int(value), so the color changes when value reaches the next whole number
+                # going up, or drops below it going down
+                if slope > 0:
+                    boundary = math.floor(value) + 1
+                else:
+                    boundary = math.floor(value)
+                wait = min(wait, (boundary - value) / slope)
+
+        return wait + CHANGE_MARGIN
+
+    def digest(self):
+        """
+        Hash of the compiled schedule, used to key the cached day table
+        """
+        return hashlib.sha1(DAY_TABLE_VERSION + self.times.tobytes() + self.rgb.tobytes()).hexdigest()
+
+    def build_day_table(self):
+        """
+        Build a SECONDS_PER_DAY x 3 table holding the int color for every second of the day
+        """
+        table = bytearray(SECONDS_PER_DAY * 3)
+        count = len(self.times)
+        for index in range(-1, count):
+            # Before the first entry and after the last one the color holds steady
+            from_index = max(index, 0)
+            to_index = min(index + 1, count - 1)
+            start = max(self.times[index], 0) if index >= 0 else 0
+            end = min(self.times[index + 1], SECONDS_PER_DAY) if index + 1 < count else SECONDS_PER_DAY
+            if end <= start:
+                continue
+
+            from_color = self.entry_color(from_index)
+            to_color = self.entry_color(to_index)
+            transition_duration = self.times[to_index] - self.times[from_index]
+            for channel in range(3):
+                table[start * 3 + channel:end * 3:3] = bytes(
+                    int(get_step_color(from_color[channel], to_color[channel], transition_duration,
+                                       seconds - self.times[from_index], False))
+                    for seconds in range(start, end))
+        return table
+
+    def load_day_table(self, directory=None):
+        """
+        Memory-map the cached day table for this schedule, building and writing it first if needed.
+
+        The cache file is named after L{digest} so a changed schedule never reads a stale table.
+        """
+        if self.day_table is not None:
+            return self.day_table
+
+        if directory is None:
+            directory = cache_directory()
+        path = os.path.join(directory, self.digest() + '.rgb')
+
+        try:
+            self.day_table = _map_file(path, SECONDS_PER_DAY * 3)
+        except (OSError, ValueError):
+            table = self.build_day_table()
+            try:
+                os.makedirs(directory, exist_ok=True)
+                temp_path = '%s.%d.tmp' % (path, os.getpid())
+                with open(temp_path, 'wb') as f:
+                    f.write(table)
+                os.replace(temp_path, path)
+                self.day_table = _map_file(path, SECONDS_PER_DAY * 3)
+            except (OSError, ValueError):
+                # Read-only or full disk, just keep the table in memory
+                self.day_table = table
+
+        return self.day_table
+
+    def table_color(self, seconds):
+        """
+        Look up the (red, green, blue) color for seconds since midnight in the day table
+        """
+        offset = int(seconds) % SECONDS_PER_DAY * 3
+        table = self.load_day_table()
+        return table[offset], table[offset + 1], table[offset + 2]
+
+def cache_directory():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'nightfall')
+
+def _map_file(path, size):
+    with open(path, 'rb') as f:
+        table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(table) != size:
+        table.close()
+        raise ValueError('%s is not a day table' % path)
+    return table
+
+def load_schedule_file(path):
+    """
+    Load the schedule profiles from a JSON or TOML file, returns a dict of profile name -> Schedule.
+
+    The file is either a single list of {'time', 'color'} entries (the "default" profile) or
+    a mapping of profile names (e.g. "weekday", "weekend") to such lists. The compiled
+    schedules are cached next to the file and reused until the file changes.
+    """
+    stat = os.stat(path)
+    cache_path = path + SCHEDULE_CACHE_SUFFIX
+    cached = _read_schedule_cache(cache_path)
+
+    # Same mtime and size: trust the cache without reading the source
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[3]
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha1(source).digest()
+
+    if cached and cached[2] == digest:
+        # Touched but not changed, refresh the cache header
+        schedules = cached[3]
+    else:
+        schedules = _parse_schedule_file(path, source)
+
+    try:
+        _write_schedule_cache(cache_path, stat, digest, schedules)
+    except OSError:
+        pass
+
+    return schedules
+
+def _parse_schedule_file(path, source):
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError('Reading TOML schedules needs Python 3.11 or newer')
+        decode_errors = (UnicodeDecodeError, tomllib.TOMLDecodeError)
+    else:
+        decode_errors = (UnicodeDecodeError, json.JSONDecodeError)
+
+    try:
+        if path.endswith('.toml'):
+            data = tomllib.loads(source.decode('utf-8'))
+        else:
+            data = json.loads(source.decode('utf-8'))
+    except decode_errors as e:
+        raise ValueError('Could not read schedule %s: %s' % (path, e))
+
+    if isinstance(data, list):
+        data = {'default': data}
+    if not isinstance(data, dict) or not data:
+        raise ValueError('Schedule %s should be a list of entries or a table of profiles' % path)
+
+    schedules = {}
+    for name, colors in data.items():
+        try:
+            schedules[name] = Schedule(colors)
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            raise ValueError('Bad entry in profile "%s" of %s: %s' % (name, path, e))
+    return schedules
+
+def _read_schedule_cache(cache_path):
+    """
+    Read a compiled schedule cache, returns (mtime_ns, size, digest, schedules) or None
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        magic, mtime_ns, size, digest, count = SCHEDULE_CACHE_HEADER.unpack_from(data)
+        if magic != SCHEDULE_CACHE_MAGIC:
+            return None
+
+        schedules = {}
+        offset = SCHEDULE_CACHE_HEADER.size
+        for i in range(count):
+            name_length, entries = SCHEDULE_CACHE_PROFILE.unpack_from(data, offset)
+            offset += SCHEDULE_CACHE_PROFILE.size
+            name = data[offset:offset + name_length].decode('utf-8')
+            offset += name_length
+
+            times = array.array('i')
+            times.frombytes(data[offset:offset + entries * times.itemsize])
+            offset += entries * times.itemsize
+            if sys.byteorder != 'little':
+                times.byteswap()
+
+            rgb = array.array('B', data[offset:offset + entries * 3])
+            offset += entries * 3
+
+            if len(times) != entries or len(rgb) != entries * 3:
+                return None
+            schedules[name] = Schedule.from_arrays(times, rgb)
+        if offset != len(data):
+            return None
+    except (OSError, struct.error, UnicodeDecodeError, ValueError):
+        return None
+
+    return mtime_ns, size, digest, schedules
+
+def _write_schedule_cache(cache_path, stat, digest, schedules):
+    chunks = [SCHEDULE_CACHE_HEADER.pack(SCHEDULE_CACHE_MAGIC, stat.st_mtime_ns, stat.st_size, digest, len(schedules))]
+    for name, schedule in schedules.items():
+        encoded_name = name.encode('utf-8')
+        chunks.append(SCHEDULE_CACHE_PROFILE.pack(len(encoded_name), len(schedule)))
+        chunks.append(encoded_name)
+        times = array.array('i', schedule.times)
+        if sys.byteorder != 'little':
+            times.byteswap()
+        chunks.append(times.tobytes())
+        chunks.append(schedule.rgb.tobytes())
+
+    temp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(b''.join(chunks))
+    os.replace(temp_path, cache_path)
+
+def run_daemon(schedules, profile=None, quiet=False, verbose=False):
+    """
+    Daemon mode: keep the BlinkStick devices open and only wake up when the color changes
+    """
+    import blinkstick
+
+    bsticks = []
+    last_color = None
+    last_scan = None
+    scan_error = None
 
+    if not quiet or verbose:
+        print("Starting daemon mode (Press Ctrl+C to stop)")
+
+    try:
+        while True:
+            current_date = datetime.datetime.today()
+            current_time = current_date.time()
+            name, schedule = schedule_for_day(current_date, schedules, profile)
+            now = seconds_since_midnight(current_time)
+            red, green, blue = schedule.color_at(now, verbose)
+            color = (int(red), int(green), int(blue))
+
+            added = []
+            if last_scan is None or time.monotonic() - last_scan >= HOTPLUG_SLEEP:
+                # Scanning the bus is what the daemon is here to avoid, so only do it
+                # every HOTPLUG_SLEEP seconds to pick up sticks that were plugged in
+                last_scan = time.monotonic()
+                try:
+                    blinkstick.get_registry().refresh()
+                    scan_error = None
+                except Exception as e:
+                    # Report a failing scan once, not on every wake up
+                    if str(e) != scan_error and (not quiet or verbose):
+                        print('could not scan for BlinkSticks: %s' % e)
+                    scan_error = str(e)
+                else:
+                    registry = blinkstick.get_registry()
+                    known = set(bstick.bs_serial for bstick in bsticks)
+                    for serial in registry.serials():
+                        device = registry.get(serial)
+                        if serial not in known and device is not None:
+                            try:
+                                added.append(blinkstick.BlinkStick(device=device))
+                            except Exception as e:
+                                if not quiet or verbose:
+                                    print('could not open %s: %s' % (serial, e))
+
+            if added:
+                if verbose:
+                    print('found %s' % ', '.join(str(bstick.bs_serial) for bstick in added))
+                bsticks.extend(added)
+                last_color = None
+                for bstick in added:
+                    # Resending the color to sticks that already have it costs nothing
+                    bstick.set_write_cache(True)
+
+            if color != last_color and bsticks:
+                if not quiet or verbose:
+                    print('%s setting color %s' % (current_time, color))
+                updated = apply_color(red, green, blue, bsticks, quiet, verbose)
+                last_color = color
+                if len(updated) < len(bsticks):
+                    if verbose:
+                        for bstick in bsticks:
+                            print('%s: %s' % (bstick.bs_serial, bstick.get_state()))
+                    # Sticks that are reconnecting stay in the list and fail fast, try
+                    # them again soon. Ones that are gone from the bus are dropped and
+                    # found again by the next scan if they come back.
+                    bsticks = [bstick for bstick in bsticks
+                               if bstick in updated or bstick.get_state() != blinkstick.DEVICE_GONE]
+                    if len(updated) < len(bsticks):
+                        last_color = None
+
+            # Wake at least every HOTPLUG_SLEEP seconds to scan for sticks, which also
+            # catches the clock jumping
+            wait = min(schedule.seconds_until_change(now), HOTPLUG_SLEEP)
+            if last_color is None and bsticks:
+                wait = min(wait, RETRY_SLEEP)
+            if verbose:
+                print('sleeping for %s seconds' % wait)
+            time.sleep(wait)
+
+    except KeyboardInterrupt:
+        if not quiet or verbose:
+            print("\nDaemon mode stopped")
 
 weekend_colors = [
     {
@@ -289,83 +774,355 @@ weekday_colors = [
     }
 ]
 
-#define speed of transition
-transition_duration = 10
-transition_progress = 5
+weekend_schedule = Schedule(weekend_colors)
+weekday_schedule = Schedule(weekday_colors)
+
+def schedule_for_day(current_date, schedules, profile=None):
+    """
+    Pick the profile to use for current_date from schedules, returns (name, Schedule)
+    """
+    if profile is None:
+        # Determine if today is a weekday (Monday=0, Sunday=6)
+        # is_weekday = current_date.weekday() < 5  # Monday-Friday are 0-4
+        is_weekday = False # vacay!
+
+        if is_weekday:
+            profile = 'weekday'
+        else:
+            profile = 'weekend'
+
+        if profile not in schedules:
+            # Files with a single profile use it every day
+            profile = 'default' if 'default' in schedules else next(iter(schedules))
+
+    return profile, schedules[profile]
+
+default_schedules = {'weekday': weekday_schedule, 'weekend': weekend_schedule}
+
+def resolve_color(current_date=None, current_time=None, schedules=None, profile=None, use_cache=True, verbose=False):
+    """
+    Resolve the (red, green, blue) color for current_date and current_time (default now).
+
+    Nothing here touches the BlinkStick, so it is safe to call from other programs.
+    """
+    if current_date is None:
+        current_date = datetime.datetime.today()
+    if current_time is None:
+        current_time = current_date.time()
+    if schedules is None:
+        schedules = default_schedules
+
+    name, schedule = schedule_for_day(current_date, schedules, profile)
+    if use_cache and not verbose:
+        return schedule.table_color(seconds_since_midnight(current_time))
+    return schedule.color_at(seconds_since_midnight(current_time), verbose)
+
+def run_on_devices(bsticks, function, *args, **kwargs):
+    """
+    Call function(bstick, *args, **kwargs) for all the bsticks at once, one thread each, so a
+    slow or failing stick doesn't hold up the others. Returns a dict of bstick -> exception
+    for the calls that failed.
+
+    If a stop event (a threading.Event) is passed in kwargs it is set on Ctrl+C, and the
+    threads are given the chance to finish before KeyboardInterrupt is raised again.
+    """
+    errors = {}
+
+    def run(bstick):
+        try:
+            function(bstick, *args, **kwargs)
+        except Exception as e:
+            errors[bstick] = e
+
+    threads = [threading.Thread(target=run, args=(bstick,), daemon=True) for bstick in bsticks]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            # join() with a timeout so Ctrl+C still reaches this thread
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        if kwargs.get('stop') is None:
+            raise
+        kwargs['stop'].set()
+        for thread in threads:
+            thread.join()
+        raise
+
+    return errors
+
+def apply_color(red, green, blue, bsticks=None, quiet=False, verbose=False):
+    """
+    Set the color on bsticks (default every attached BlinkStick), returns the ones that worked
+    """
+    import blinkstick, usb
+
+    if bsticks is None:
+        bsticks = blinkstick.find_all()
+
+    def set_color(bstick):
+        if not quiet or verbose:
+            print("setting color")
+        bstick.set_color(channel=0, index=0, red=red, green=green, blue=blue, name=None, hex=None)
+
+    errors = run_on_devices(bsticks, set_color)
+    for bstick, e in errors.items():
+        if not isinstance(e, (usb.USBError, blinkstick.BlinkStickException)):
+            raise e
+        if not quiet or verbose:
+            print("failed: %s" % e)
+
+    return [bstick for bstick in bsticks if bstick not in errors]
+
+effects = {'christmas': christmas_light_mode}
+
+def run_effect(effect, bsticks=None, quiet=False, verbose=False, **options):
+    """
+    Run one of the effects (e.g. 'christmas') on bsticks (default every attached BlinkStick),
+    passing options (e.g. fps) on to the effect
+    """
+    import blinkstick
+
+    if bsticks is None:
+        bsticks = blinkstick.find_all()
+
+    if not quiet or verbose:
+        print("Starting %s light mode on %d BlinkStick(s)" % (effect.capitalize(), len(bsticks)))
+
+    try:
+        errors = run_on_devices(bsticks, effects[effect], verbose, stop=threading.Event(), **options)
+    except KeyboardInterrupt:
+        return
+
+    for bstick, e in errors.items():
+        if not quiet or verbose:
+            print("failed: %s" % e)
+
+def simulate(start, end, step=1, schedules=None, profile=None, use_cache=True):
+    """
+    Replay the schedule from start to end (datetimes), one frame every step seconds, without
+    touching any BlinkStick. Yields (chunk_start, rgb) with the packed colors of consecutive
+    frames, one chunk per day at most.
+    """
+    if schedules is None:
+        schedules = default_schedules
+
+    tables = {}
+    when = start
+    while when < end:
+        next_day = datetime.datetime.combine(when.date() + datetime.timedelta(days=1), datetime.time())
+        chunk_end = min(next_day, end)
+        count = int(math.ceil((chunk_end - when).total_seconds() / step))
+        name, schedule = schedule_for_day(when, schedules, profile)
+        first = seconds_since_midnight(when.time())
 
-# Determine if today is a weekday (Monday=0, Sunday=6)
-# is_weekday = current_date.weekday() < 5  # Monday-Friday are 0-4
-is_weekday = False # vacay!
+        if first == int(first) and step == int(step):
+            # Whole seconds line up with the day table, so every channel is a strided slice of it
+            if use_cache:
+                table = schedule.load_day_table()
+            else:
+                # Without the cache file the table is still built once per schedule
+                table = tables.get(name)
+                if table is None:
+                    table = tables[name] = schedule.build_day_table()
+            first = int(first) * 3
+            stride = int(step) * 3
+            rgb = bytearray(count * 3)
+            for channel in range(3):
+                rgb[channel::3] = table[first + channel:first + channel + count * stride:stride]
+        else:
+            rgb = bytearray()
+            for frame in range(count):
+                rgb.extend(int(value) for value in schedule.color_at(first + frame * step))
+
+        yield when, rgb
+        when += datetime.timedelta(seconds=count * step)
+
+def write_simulation(chunks, out, output_format='csv', step=1, rate=0):
+    """
+    Write simulated frames to out as CSV (time,red,green,blue) or as a binary stream.
+
+    The binary stream is a SIMULATION_HEADER (magic, start as unix time, step) followed by
+    3 bytes of RGB per frame. With rate > 0 frames are written rate times faster than real
+    time, otherwise as fast as possible. Returns the number of frames written.
+    """
+    frames = 0
+    started = time.monotonic()
+    header_written = False
+    # Days start at the same time of day, so their time columns are only formatted once
+    time_texts = {}
+
+    for chunk_start, rgb in chunks:
+        if output_format == 'binary':
+            if not header_written:
+                out.write(SIMULATION_HEADER.pack(SIMULATION_MAGIC, chunk_start.timestamp(), step))
+                header_written = True
+        else:
+            offset = seconds_since_midnight(chunk_start.time())
+            key = (offset, len(rgb) // 3)
+            times = time_texts.get(key)
+            if times is None:
+                times = time_texts[key] = [format_seconds(offset + i * step) for i in range(len(rgb) // 3)]
+            day = chunk_start.strftime('%Y-%m-%d ')
+            stamps = [day + text for text in times]
+
+        if rate > 0:
+            chunk_frames = range(len(rgb) // 3)
+        else:
+            # Nothing to wait for, write the whole chunk in one go
+            chunk_frames = [None]
+
+        for frame in chunk_frames:
+            if frame is None:
+                data, first, count = rgb, 0, len(rgb) // 3
+            else:
+                data, first, count = rgb[frame * 3:frame * 3 + 3], frame, 1
+                # Deadline for this frame in real time, measured from the start of the replay
+                delay = started + (frames * step) / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if output_format == 'binary':
+                out.write(bytes(data))
+            else:
+                decimal = SIMULATION_DECIMALS.__getitem__
+                rows = zip(stamps[first:first + count], map(decimal, data[0::3]), map(decimal, data[1::3]), map(decimal, data[2::3]))
+                out.write('\n'.join(map(','.join, rows)) + '\n')
+            frames += count
+
+    return frames
+
+def parse_when(value):
+    """
+    argparse type for --simulate: an ISO date and time, or a time today
+    """
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.combine(datetime.date.today(), datetime.datetime.strptime(value, '%H:%M:%S').time())
+    except ValueError:
+        raise argparse.ArgumentTypeError('%s is not a date and time (e.g. 2024-01-01T06:00:00) or a time (e.g. 06:00:00)' % value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Visual indication of time using blinkstick')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
+                        help='suppress normal output')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
+                        help='enable extra debugging output')
+    parser.add_argument('-t', '--time', dest='time',
+                        type=str,
+                        help='UTC formated time (e.g. 20:07:00)')
+    parser.add_argument('-d', '--day', dest='day',
+                        type=int, choices=range(0, 7),
+                        help='Day of the week (0=Monday, 1=Tuesday, 2=Wednesday, 3=Thursday, 4=Friday, 5=Saturday, 6=Sunday)')
+    parser.add_argument('--christmas', dest='christmas', action='store_true',
+                        help='enable Christmas light mode (random color cycling)')
+    parser.add_argument('--fps', dest='fps',
+                        type=float, default=10,
+                        help='frames per second for Christmas light mode fades (default 10)')
+    parser.add_argument('--daemon', dest='daemon', action='store_true',
+                        help='keep running and update the color whenever it changes (ignores --time and --day)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='work out the color directly instead of using the cached whole-day color table')
+    parser.add_argument('-s', '--schedule', dest='schedule',
+                        type=str,
+                        help='JSON or TOML file of schedule profiles to use instead of the built in ones')
+    parser.add_argument('-p', '--profile', dest='profile',
+                        type=str,
+                        help='schedule profile to use every day (e.g. weekday, weekend)')
+    parser.add_argument('--simulate', dest='simulate', nargs=2, metavar=('START', 'END'),
+                        type=parse_when,
+                        help='write the colors from START to END (e.g. 2024-01-01T00:00:00) instead of setting them')
+    parser.add_argument('--rate', dest='rate',
+                        type=float, default=0,
+                        help='with --simulate, replay this many times faster than real time (default as fast as possible)')
+    parser.add_argument('--step', dest='step',
+                        type=float, default=1,
+                        help='with --simulate, seconds between frames (default 1)')
+    parser.add_argument('--format', dest='format', choices=['csv', 'binary'], default='csv',
+                        help='with --simulate, output format (default csv)')
+    parser.add_argument('-o', '--output', dest='output',
+                        type=str, default='-',
+                        help='with --simulate, file to write the frames to (default stdout)')
+    args = parser.parse_args(argv)
+
+    if args.simulate and args.step <= 0:
+        parser.error('--step must be more than 0')
+    if args.fps <= 0:
+        parser.error('--fps must be more than 0')
+    if args.simulate and args.output == '-':
+        # The frames go to stdout, keep it clean
+        args.quiet = True
+        args.verbose = False
 
-# Set colors based on weekday or weekend
-if is_weekday:
-    colors = weekday_colors
     if not args.quiet or args.verbose:
-        print('Using weekday colors')
-else:
-    colors = weekend_colors
+        print("Starting...")
+
+    if args.time:
+        current_time = datetime.datetime.strptime(args.time, '%H:%M:%S').time()
+        # Use today's date for weekday check even with custom time
+        current_date = datetime.datetime.today()
+    else:
+        current_date = datetime.datetime.today()
+        current_time = current_date.time()
+
+    # Override the day of week if specified
+    if args.day is not None:
+        # Calculate the offset to the desired day
+        current_weekday = current_date.weekday()
+        days_offset = args.day - current_weekday
+        current_date = current_date + datetime.timedelta(days=days_offset)
+
     if not args.quiet or args.verbose:
-        print('Using weekend colors')
-
-# Always resolve a color and time, even if current_time is outside the defined ranges
-from_color = colors[0]['color']
-from_time = datetime.datetime.strptime(colors[0]['time'], '%H:%M:%S').time()
-to_color = colors[0]['color']
-to_time = from_time
-found = False
-for index, key in enumerate(colors):
-    this_time = datetime.datetime.strptime(key['time'], '%H:%M:%S').time()
-    if current_time < this_time:
-        to_color = key['color']
-        to_time = this_time
-        # Use previous color/time if available, else first
-        if index > 0:
-            from_color = colors[index-1]['color']
-            from_time = datetime.datetime.strptime(colors[index-1]['time'], '%H:%M:%S').time()
-        found = True
-        if args.verbose:
-            print('next time ' + str(to_time))
-        break
+        print('current time:' + str(current_time))
+        print('day of week: %s (%d)' % (current_date.strftime('%A'), current_date.weekday()))
+
+    if args.schedule:
+        try:
+            schedules = load_schedule_file(args.schedule)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
     else:
-        from_color = key['color']
-        from_time = this_time
-
-# If current_time is after the last color, use the last color for both from and to
-if not found:
-    to_color = from_color
-    to_time = from_time
-
-transition_duration_time = (datetime.datetime.combine(datetime.date.today(), to_time) - datetime.datetime.combine(datetime.date.today(), from_time))
-transition_duration = transition_duration_time.total_seconds()
-transition_progress_time = (datetime.datetime.combine(datetime.date.today(), current_time) - datetime.datetime.combine(datetime.date.today(), from_time))
-transition_progress = transition_progress_time.total_seconds()
-if args.verbose:
-    print(str(transition_progress))
-
-if args.verbose:
-    print('red:')
-red = get_step_color(from_color[0], to_color[0], transition_duration, transition_progress, args.verbose)
-if args.verbose:
-    print('green:')
-green = get_step_color(from_color[1], to_color[1], transition_duration, transition_progress, args.verbose)
-if args.verbose:
-    print('blue:')
-blue = get_step_color(from_color[2], to_color[2], transition_duration, transition_progress, args.verbose)
-
-for bstick in blinkstick.find_all():
-    #if True:
+        schedules = default_schedules
+
+    if args.profile is not None and args.profile not in schedules:
+        parser.error('unknown profile %s (choose from %s)' % (args.profile, ', '.join(schedules)))
+
+    # Set colors based on weekday or weekend
+    name, schedule = schedule_for_day(current_date, schedules, args.profile)
+    if not args.quiet or args.verbose:
+        print('Using %s colors' % name)
+
+    if args.simulate:
+        start, end = args.simulate
+        chunks = simulate(start, end, args.step, schedules, args.profile, args.cache)
+        started = time.monotonic()
+        if args.output == '-':
+            out = sys.stdout.buffer if args.format == 'binary' else sys.stdout
+            frames = write_simulation(chunks, out, args.format, args.step, args.rate)
+            out.flush()
+        else:
+            with open(args.output, 'wb' if args.format == 'binary' else 'w') as out:
+                frames = write_simulation(chunks, out, args.format, args.step, args.rate)
+        elapsed = time.monotonic() - started
+        sys.stderr.write('%d frames in %.3f seconds (%d frames/s)\n' % (frames, elapsed, frames / elapsed if elapsed else 0))
+        return
+
+    red, green, blue = resolve_color(current_date, current_time, schedules, args.profile, args.cache, args.verbose)
+
     if args.christmas:
-        if not args.quiet or args.verbose:
-            print("Starting Christmas light mode")
-        christmas_light_mode(bstick, args.verbose)
+        run_effect('christmas', quiet=args.quiet, verbose=args.verbose, fps=args.fps)
+    elif args.daemon:
+        run_daemon(schedules, args.profile, args.quiet, args.verbose)
     else:
-        if not args.quiet or args.verbose:
-            print("setting color")
-        try:
-            bstick.set_color(channel=0, index=0, red=red, green=green, blue=blue, name=None, hex=None)
-        except usb.USBError as e:
-            if not args.quiet or args.verbose:
-                print("failed: %s" % e)
+        apply_color(red, green, blue, quiet=args.quiet, verbose=args.verbose)
+
+    if not args.quiet or args.verbose:
+        print("...done")
 
-if not args.quiet or args.verbose:
-    print("...done")
+if __name__ == '__main__':
+    main()